@@ -1,24 +1,390 @@
 #!/usr/bin/env python3
 import time
 import logging
+import logging.handlers
+import queue
+import atexit
 import threading
 import json
 import os
+import hashlib
+import itertools
+import functools
+import heapq
+import re
+import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict, deque
 from datetime import datetime, timedelta
 from proxmox_api import ProxmoxAPI
 from node_selector import NodeSelector
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("load_balancer.log"),
-        logging.StreamHandler()
-    ]
-)
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
 logger = logging.getLogger("ProxmoxLoadBalancer")
 
+_log_listener = None
+
+def configure_logging(log_file="load_balancer.log", level=logging.INFO):
+    """
+    Set up logging to the console and to a rotating log file
+    
+    Records are passed through a queue to a background listener thread, so the
+    balancing loop never blocks on console or disk writes. Calling this again
+    has no effect.
+    
+    Args:
+        log_file (str): Path of the log file
+        level (int): Logging level of the root logger
+        
+    Returns:
+        QueueListener: The running listener
+    """
+    global _log_listener
+    if _log_listener:
+        return _log_listener
+    
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=10 << 20, backupCount=5)
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler,
+                                                   respect_handler_level=True)
+    _log_listener.start()
+    # Flush pending records on interpreter exit
+    atexit.register(_log_listener.stop)
+    return _log_listener
+
+@functools.lru_cache(maxsize=4096)
+def _norm_vmid(vm_id):
+    """
+    Normalize a VM ID coming from Proxmox, the configuration or the API to an int
+    
+    Args:
+        vm_id (int or str): VM ID
+        
+    Returns:
+        int: VM ID
+        
+    Raises:
+        ValueError: If the VM ID is not a number
+    """
+    return int(vm_id)
+
+def _json_loads(data):
+    """Parse JSON from bytes, with orjson when available"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj):
+    """Serialize an object to indented JSON bytes, with orjson when available"""
+    if orjson:
+        # Accept int dict keys like the json module does, and NumPy scalars/arrays
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS |
+                            orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, indent=2, default=_json_default).encode('utf-8')
+
+def _json_default(obj):
+    """Convert NumPy values for the json module"""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# VM name prefix used for affinity grouping, e.g. "app" in "app-web1"
+_NAME_PREFIX_RE = re.compile(r'^([^-]{2,})-')
+
+# Number of performance samples kept per VM
+MAX_VM_HISTORY = 100
+
+# Number of recent samples the anomaly detection compares the current value with
+ANOMALY_WINDOW = 5
+
+# Allowed range of numeric settings, checked on top of their type
+_CONFIG_RANGES = {
+    "check_interval": lambda v: v > 0,
+    "min_balance_interval": lambda v: v > 0,
+    "max_parallel_migrations": lambda v: v > 0,
+    "migration_history_max": lambda v: v > 0,
+    "migration_timeout": lambda v: v > 0,
+    "report_cache_ttl": lambda v: v >= 0,
+    "high_load_threshold": lambda v: 0 <= v <= 1,
+    "low_load_threshold": lambda v: 0 <= v <= 1,
+}
+
+class _VMHistory:
+    """
+    Ring buffer of the performance samples of one VM
+    
+    Samples are stored column by column in fixed-size NumPy arrays, so the
+    correlation and anomaly computations read contiguous buffers directly.
+    """
+    
+    def __init__(self, size=MAX_VM_HISTORY, window=ANOMALY_WINDOW):
+        """
+        Initialize an empty history
+        
+        Args:
+            size (int): Maximum number of samples kept
+            window (int): Number of recent CPU samples covered by cpu_window_stats()
+        """
+        self.timestamp = np.zeros(size)
+        self.cpu = np.zeros(size, dtype=np.float32)
+        self.memory_used = np.zeros(size)
+        self.node = None  # Node the VM was last seen on
+        self._index = 0  # Position of the next sample
+        self._count = 0
+        # Running sums of the CPU samples in the window
+        self._window = min(window, size)
+        self._cpu_sum = 0.0
+        self._cpu_sumsq = 0.0
+    
+    def __len__(self):
+        return self._count
+    
+    def append(self, cpu, memory_used, node, timestamp=None):
+        """
+        Add a sample, overwriting the oldest one once the buffer is full
+        
+        Args:
+            cpu (float): CPU usage
+            memory_used (int): Memory used in bytes
+            node (str): Node the VM runs on
+            timestamp (float, optional): Sample time, defaults to now
+        """
+        # Slide the window: drop the sample that falls out of it
+        if self._count >= self._window:
+            evicted = float(self.cpu[(self._index - self._window) % len(self.cpu)])
+            self._cpu_sum -= evicted
+            self._cpu_sumsq -= evicted * evicted
+        
+        self.timestamp[self._index] = time.time() if timestamp is None else timestamp
+        self.cpu[self._index] = cpu
+        self.memory_used[self._index] = memory_used
+        added = float(self.cpu[self._index])
+        self._cpu_sum += added
+        self._cpu_sumsq += added * added
+        self.node = node
+        self._index = (self._index + 1) % len(self.cpu)
+        self._count = min(self._count + 1, len(self.cpu))
+    
+    def cpu_window_stats(self):
+        """
+        Get the mean and standard deviation of the CPU samples in the window
+        
+        Returns:
+            tuple: (mean, std), computed over fewer samples until the window is full
+        """
+        count = min(self._count, self._window)
+        if count == 0:
+            return 0.0, 0.0
+        mean = self._cpu_sum / count
+        variance = self._cpu_sumsq / count - mean * mean
+        # Rounding in the running sums must not turn a flat series into a spike
+        if variance < 1e-12:
+            return mean, 0.0
+        return mean, variance ** 0.5
+    
+    def recent(self, field, count):
+        """
+        Get the most recent values of a field
+        
+        Args:
+            field (str): 'timestamp', 'cpu' or 'memory_used'
+            count (int): Number of values to return
+            
+        Returns:
+            np.ndarray: Up to `count` values, oldest first
+        """
+        values = getattr(self, field)
+        count = max(0, min(count, self._count))
+        return values[(self._index - count + np.arange(count)) % len(values)]
+
+def _last_items(items, count):
+    """
+    Get the last items of a list or deque without copying the whole sequence
+    
+    Args:
+        items (list or deque): Sequence to read from
+        count (int): Number of items to return
+        
+    Returns:
+        list: Up to `count` items, oldest first
+    """
+    if count <= 0:
+        return []
+    recent = list(itertools.islice(reversed(items), count))
+    recent.reverse()
+    return recent
+
+def _safe_ratios(used, total):
+    """
+    Divide used amounts by totals element-wise, with 0 where the total is not positive
+    
+    Args:
+        used (iterable): Used amounts
+        total (iterable): Matching totals
+        
+    Returns:
+        list: Ratios as Python floats
+    """
+    used = np.asarray(used, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    return np.divide(used, total, out=np.zeros_like(used), where=total > 0).tolist()
+
+def _describe(values):
+    """
+    Summarize a set of measurements with the usual descriptive statistics
+    
+    Args:
+        values (list): Measurements, e.g. the CPU usage of each node
+        
+    Returns:
+        dict: count, min, max, mean, median, std, p95, skew and kurtosis (excess),
+            all 0 when there are no measurements
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return dict.fromkeys(('count', 'min', 'max', 'mean', 'median', 'std', 'p95', 'skew', 'kurtosis'), 0)
+    
+    mean = values.mean()
+    std = values.std()
+    if std > 0:
+        z = (values - mean) / std
+        skew = (z ** 3).mean()
+        kurtosis = (z ** 4).mean() - 3
+    else:
+        skew = kurtosis = 0.0
+    median, p95 = np.percentile(values, [50, 95])
+    
+    return {
+        'count': int(values.size),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(mean),
+        'median': float(median),
+        'std': float(std),
+        'p95': float(p95),
+        'skew': float(skew),
+        'kurtosis': float(kurtosis)
+    }
+
+class _ClusterSnapshot:
+    """
+    Point-in-time view of the cluster shared by a single balance cycle
+    
+    Proxmox API responses are fetched on first use and then reused, so every
+    step of the cycle sees the same data without repeating HTTP round-trips.
+    """
+    
+    def __init__(self, proxmox_api, executor=None):
+        """
+        Initialize the snapshot
+        
+        Args:
+            proxmox_api (ProxmoxAPI): Instance of the ProxmoxAPI class
+            executor (ThreadPoolExecutor, optional): Pool used to fetch per-node data in parallel
+        """
+        self.proxmox_api = proxmox_api
+        self.executor = executor
+        self._nodes = None
+        self._nodes_usage = None
+        self._node_vms = {}
+        self._node_status = {}
+        self._vm_locations = None
+    
+    @property
+    def nodes(self):
+        """List of all nodes in the cluster"""
+        if self._nodes is None:
+            self._nodes = self.proxmox_api.get_nodes() or []
+        return self._nodes
+    
+    @property
+    def nodes_usage(self):
+        """Resource usage of all nodes in the cluster"""
+        if self._nodes_usage is None:
+            self._nodes_usage = self.proxmox_api.get_resource_usage(self.nodes) or []
+        return self._nodes_usage
+    
+    def get_node_vms(self, node_name):
+        """Get all VMs on a specific node"""
+        if node_name not in self._node_vms:
+            self._node_vms[node_name] = self.proxmox_api.get_node_vms(node_name) or []
+        return self._node_vms[node_name]
+    
+    def get_node_status(self, node_name):
+        """Get status information for a specific node"""
+        if node_name not in self._node_status:
+            self._node_status[node_name] = self.proxmox_api.get_node_status(node_name)
+        return self._node_status[node_name]
+    
+    def prefetch_node_status(self, node_names):
+        """
+        Fetch the status of several nodes, in parallel when an executor is available
+        
+        Args:
+            node_names (iterable): Names of the nodes
+        """
+        missing = [name for name in dict.fromkeys(node_names) if name not in self._node_status]
+        if self.executor is None or len(missing) < 2:
+            for node_name in missing:
+                self.get_node_status(node_name)
+            return
+        
+        for node_name, status in zip(missing, self.executor.map(self.proxmox_api.get_node_status, missing)):
+            self._node_status[node_name] = status
+    
+    def prefetch_node_vms(self):
+        """Fetch the VM lists of all online nodes, in parallel when an executor is available"""
+        missing = [node['node'] for node in self.nodes
+                   if node['status'] == 'online' and node['node'] not in self._node_vms]
+        if self.executor is None or len(missing) < 2:
+            for node_name in missing:
+                self.get_node_vms(node_name)
+            return
+        
+        for node_name, vms in zip(missing, self.executor.map(self.proxmox_api.get_node_vms, missing)):
+            self._node_vms[node_name] = vms or []
+    
+    def iter_vms(self, running_only=False):
+        """
+        Iterate over the VMs of all online nodes
+        
+        Args:
+            running_only (bool): Skip VMs that are not running
+            
+        Yields:
+            tuple: (node name, VM entry from the node's VM list)
+        """
+        self.prefetch_node_vms()
+        for node in self.nodes:
+            if node['status'] != 'online':
+                continue
+            for vm in self.get_node_vms(node['node']):
+                if not running_only or vm['status'] == 'running':
+                    yield node['node'], vm
+    
+    @property
+    def vm_locations(self):
+        """Map of VM ID to the name of the online node running it"""
+        if self._vm_locations is None:
+            self._vm_locations = {}
+            for node_name, vm in self.iter_vms():
+                self._vm_locations.setdefault(_norm_vmid(vm['vmid']), node_name)
+        return self._vm_locations
+
 class LoadBalancer:
     """Intelligent Load Balancer for Proxmox clusters"""
     
@@ -34,10 +400,26 @@ class LoadBalancer:
         self.node_selector = NodeSelector(proxmox_api)
         self.running = False
         self.thread = None
+        self._stop_event = threading.Event()  # Wakes the balancing loop on stop()
+        self._saved_config_digests = {}  # Digest of the last content written to each config file
+        self._config_dirty = False  # Config changed since the last flush_config()
+        self._config_lock = threading.Lock()  # Serializes config file writes across threads
+        self._last_snapshot_hash = None  # Cluster fingerprint of the last cycle that changed nothing
         self.load_config(config_file)
-        self.migration_history = []
+        self.migration_history = deque(maxlen=max(1, self.config["migration_history_max"]))
+        self._history_lock = threading.Lock()  # Guards migration_history, held while it is appended to or copied
         self.last_balance_time = {}  # Track when each VM was last balanced
+        self._migration_index = {}  # (VM ID, target node) -> latest completed migration
+        self._pending_migrations = []  # Records of migrations still waiting for a result, guarded by _history_lock
+        self._history_by_vm = defaultdict(deque)  # VM ID -> its records in migration_history, oldest first, guarded by _history_lock
+        self._report_cache = {}  # report key -> (build time, report)
+        self._report_locks = {}  # report key -> lock held while the report is rebuilt
         self.vm_performance_history = {}  # Track VM performance over time
+        self._last_node_states = None  # Node name -> status seen in the last balance cycle
+        self._proxmox_config_dirty = False  # Set by on_cluster_change()
+        self._critical_vms_dirty = False  # Set by on_cluster_change()
+        # Reused across cycles for parallel Proxmox API requests
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="lb-fetch")
         
         # Check if Proxmox auto-configuration is enabled
         if self.config.get("auto_configure_proxmox", True):
@@ -75,6 +457,9 @@ class LoadBalancer:
                 "end": 6  # 6 AM
             },
             "learning_enabled": True,  # Whether to learn from migration outcomes
+            "migration_history_max": 500,  # Maximum number of migrations kept in memory
+            "migration_timeout": 7200,  # Seconds to wait for the task of an initiated migration to show up
+            "report_cache_ttl": 2.0,  # Seconds a status or health report is reused by API callers
             "ai_features": {
                 "prediction_enabled": True,
                 "vm_profiling": True,
@@ -89,26 +474,30 @@ class LoadBalancer:
                 "critical_vms": [],  # List of VM IDs considered critical for HA
                 "check_proxmox_config_interval": 86400  # Check Proxmox config once a day
             },
-            "last_proxmox_config_check": 0  # Timestamp of last Proxmox config check
+            "last_proxmox_config_check": 0.0  # Timestamp of last Proxmox config check
         }
+        self._config_defaults = dict(self.config)  # Values are checked against the type of these
         
         # Override with file config if provided
         if config_file and os.path.exists(config_file):
             try:
-                with open(config_file, 'r') as f:
-                    file_config = json.load(f)
-                    # Update config with file values
-                    for key, value in file_config.items():
-                        if key == "resource_weights" and isinstance(value, dict):
-                            # Ensure weights sum to 1
-                            total = sum(value.values())
-                            if abs(total - 1.0) > 0.01:
-                                logger.warning("Resource weights don't sum to 1.0, normalizing")
-                                self.config["resource_weights"] = {k: v/total for k, v in value.items()}
-                            else:
-                                self.config["resource_weights"] = value
-                        else:
-                            self.config[key] = value
+                with open(config_file, 'rb') as f:
+                    file_config = _json_loads(f.read())
+                if not isinstance(file_config, dict):
+                    raise ValueError("configuration must be a JSON object")
+                    
+                # Update config with valid file values
+                for key, value in file_config.items():
+                    if not self._is_valid_config_value(key, value):
+                        logger.warning(f"Ignoring invalid value for '{key}' in {config_file}: {value!r}")
+                        continue
+                    if key == "resource_weights":
+                        # Ensure weights sum to 1
+                        total = sum(value.values())
+                        if abs(total - 1.0) > 0.01:
+                            logger.warning("Resource weights don't sum to 1.0, normalizing")
+                            value = {k: v/total for k, v in value.items()}
+                    self.config[key] = value
                 logger.info(f"Loaded configuration from {config_file}")
             except Exception as e:
                 logger.error(f"Error loading config from {config_file}: {str(e)}")
@@ -116,6 +505,91 @@ class LoadBalancer:
         # Update node selector weights
         self.node_selector.set_weights(self.config["resource_weights"])
         
+        # Build VM exclusion and group lookups
+        self._index_vm_config()
+        
+    def _is_valid_config_value(self, key, value):
+        """
+        Check a configuration value against the type of its default and its allowed range
+        
+        Keys without a default are accepted as they are.
+        
+        Args:
+            key (str): Configuration key
+            value: Value read from the configuration file or sent to the API
+            
+        Returns:
+            bool: Whether the value can be used
+        """
+        if key not in self._config_defaults:
+            return True
+        default = self._config_defaults[key]
+        
+        if isinstance(default, bool):
+            return isinstance(value, bool)
+        if isinstance(default, int):
+            # Counts and sizes such as max_parallel_migrations must be whole numbers
+            return (isinstance(value, int) and not isinstance(value, bool) and
+                    _CONFIG_RANGES.get(key, lambda v: True)(value))
+        if isinstance(default, float):
+            return (isinstance(value, (int, float)) and not isinstance(value, bool) and
+                    _CONFIG_RANGES.get(key, lambda v: True)(value))
+        if key == "resource_weights":
+            return (isinstance(value, dict) and value and
+                    all(isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0 for v in value.values()) and
+                    sum(value.values()) > 0)
+        if key == "off_hours":
+            return (isinstance(value, dict) and
+                    all(isinstance(value.get(k), int) and not isinstance(value[k], bool) and 0 <= value[k] <= 23
+                        for k in ("start", "end")))
+        return isinstance(value, type(default))
+    
+    def _index_vm_config(self):
+        """
+        Normalize configured VM IDs and build constant-time lookups for VM exclusions and VM groups
+        
+        The VM IDs of "vm_exclusions", "vm_groups" and "critical_vms" are stored
+        back as ints. Must be called again whenever one of them changes.
+        """
+        # The configuration changed, the next balance cycle must run in full
+        self._last_snapshot_hash = None
+        
+        if "vm_exclusions" in self.config:
+            self.config["vm_exclusions"] = self._to_vmid_list(self.config["vm_exclusions"])
+        if "vm_groups" in self.config:
+            self.config["vm_groups"] = {group_name: self._to_vmid_list(group_vms)
+                                        for group_name, group_vms in self.config["vm_groups"].items()}
+        proxmox_config = self.config.get("proxmox_config", {})
+        if "critical_vms" in proxmox_config:
+            proxmox_config["critical_vms"] = self._to_vmid_list(proxmox_config["critical_vms"])
+        
+        self._vm_exclusion_ids = set(self.config.get("vm_exclusions", []))
+        self._vm_group_ids = {}  # group name -> set of int VM IDs
+        self._vm_group_index = {}  # int VM ID -> name of the first group containing it
+        for group_name, group_vms in self.config.get("vm_groups", {}).items():
+            vm_ids = set(group_vms)
+            self._vm_group_ids[group_name] = vm_ids
+            for vm_id in vm_ids:
+                self._vm_group_index.setdefault(vm_id, group_name)
+    
+    def _to_vmid_list(self, vm_ids):
+        """
+        Convert a list of VM IDs (int or str) to a list of unique ints
+        
+        Args:
+            vm_ids (list): VM IDs as found in the configuration
+            
+        Returns:
+            list: VM IDs as integers in their original order, invalid entries are skipped
+        """
+        result = {}
+        for vm_id in vm_ids:
+            try:
+                result[_norm_vmid(vm_id)] = None
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring invalid VM ID in configuration: {vm_id!r}")
+        return list(result)
+        
     def save_config(self, config_file="load_balancer_config.json"):
         """
         Save current configuration to file
@@ -124,14 +598,51 @@ class LoadBalancer:
             config_file (str): Path to save configuration file
         """
         try:
-            with open(config_file, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            with self._config_lock:
+                data = _json_dumps(self.config)
+                
+                # Skip the write if this exact content was already saved
+                digest = hashlib.blake2b(data).digest()
+                if self._saved_config_digests.get(config_file) == digest:
+                    logger.debug("Configuration unchanged, not rewriting %s", config_file)
+                    return True
+                
+                # Write to a temporary file and swap it in so a crash never leaves a truncated config
+                tmp_file = f"{config_file}.tmp"
+                with open(tmp_file, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, config_file)
+                
+                self._saved_config_digests[config_file] = digest
             logger.info(f"Configuration saved to {config_file}")
             return True
         except Exception as e:
             logger.error(f"Error saving config to {config_file}: {str(e)}")
             return False
     
+    def _mark_config_dirty(self):
+        """Record that the configuration changed and must be written by flush_config()"""
+        self._config_dirty = True
+    
+    def flush_config(self, config_file="load_balancer_config.json"):
+        """
+        Save the configuration if it changed since the last flush
+        
+        Args:
+            config_file (str): Path to save configuration file
+            
+        Returns:
+            bool: Whether the configuration is saved
+        """
+        if not self._config_dirty:
+            return True
+        saved = self.save_config(config_file)
+        if saved:
+            self._config_dirty = False
+        return saved
+    
     def start(self):
         """Start the load balancer in a separate thread"""
         if self.running:
@@ -139,6 +650,7 @@ class LoadBalancer:
             return False
             
         self.running = True
+        self._stop_event.clear()
         self.thread = threading.Thread(target=self._balancing_loop)
         self.thread.daemon = True
         self.thread.start()
@@ -152,6 +664,7 @@ class LoadBalancer:
             return False
             
         self.running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join(timeout=5)
         logger.info("Load balancer stopped")
@@ -159,7 +672,7 @@ class LoadBalancer:
         
     def _balancing_loop(self):
         """Main loop for periodic load balancing"""
-        last_resource_update = 0
+        last_resource_update = float('-inf')
         resource_update_interval = 60  # Update resources every minute
         
         while self.running:
@@ -167,36 +680,64 @@ class LoadBalancer:
                 # Check and monitor migration status
                 self.monitor_migrations()
                 
+                # Cluster state shared by the resource update and the balance check
+                snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+                
                 # Update resource usage periodically
-                current_time = time.time()
+                current_time = time.monotonic()
                 if current_time - last_resource_update > resource_update_interval:
-                    self.periodic_update_resources()
+                    self.periodic_update_resources(snapshot)
                     last_resource_update = current_time
                 
                 # Check if balance is needed
-                self.balance_cluster()
+                self.balance_cluster(snapshot)
+                
+                # Re-check Proxmox configuration after a cluster change, or once its interval elapsed
+                if self.config.get("auto_configure_proxmox", True):
+                    self.check_and_configure_proxmox(force=self._proxmox_config_dirty)
                 
             except Exception as e:
-                logger.error(f"Error in balancing loop: {str(e)}")
+                logger.error("Error in balancing loop: %s", e)
                 
-            # Sleep for check interval
-            for _ in range(self.config["check_interval"]):
-                if not self.running:
-                    break
-                time.sleep(1)
+            # Sleep for check interval, waking up early if stop() is called
+            if self._stop_event.wait(self.config["check_interval"]):
+                break
     
-    def _is_migration_allowed(self, vm_id):
+    def _is_off_hours(self, hour=None):
+        """
+        Check if an hour falls within the configured off hours
+        
+        Args:
+            hour (int, optional): Hour of the day, defaults to the current hour
+            
+        Returns:
+            bool: Whether the hour is within off hours
+        """
+        if hour is None:
+            hour = datetime.now().hour
+        off_hours_start = self.config["off_hours"]["start"]
+        off_hours_end = self.config["off_hours"]["end"]
+        
+        if off_hours_start == off_hours_end:
+            # Off hours cover the whole day
+            return True
+        
+        # Distance from the start of the window, wrapping around midnight
+        return (hour - off_hours_start) % 24 < (off_hours_end - off_hours_start) % 24
+    
+    def _is_migration_allowed(self, vm_id, off_hours=None):
         """
         Check if migration is allowed for a VM
         
         Args:
             vm_id (int): VM ID
+            off_hours (bool, optional): Result of _is_off_hours() if already computed
             
         Returns:
             bool: Whether migration is allowed
         """
         # Check exclusions
-        if str(vm_id) in self.config["vm_exclusions"] or int(vm_id) in self.config["vm_exclusions"]:
+        if _norm_vmid(vm_id) in self._vm_exclusion_ids:
             return False
             
         # Check last balance time
@@ -207,20 +748,11 @@ class LoadBalancer:
         
         # Check time of day restrictions
         if self.config["consider_time_of_day"]:
-            current_hour = datetime.now().hour
-            off_hours_start = self.config["off_hours"]["start"]
-            off_hours_end = self.config["off_hours"]["end"]
-            
-            # Check if current time is outside off hours
-            if off_hours_start < off_hours_end:
-                # Simple case: off hours within the same day
-                is_off_hours = off_hours_start <= current_hour < off_hours_end
-            else:
-                # Complex case: off hours span midnight
-                is_off_hours = current_hour >= off_hours_start or current_hour < off_hours_end
+            if off_hours is None:
+                off_hours = self._is_off_hours()
             
             # Only allow migrations during off hours
-            if not is_off_hours:
+            if not off_hours:
                 return False
         
         return True
@@ -241,81 +773,99 @@ class LoadBalancer:
             'disk': vm_info.get('maxdisk', 10 * 1024 * 1024 * 1024)  # Default to 10GB if not found
         }
     
-    def detect_overloaded_nodes(self):
+    def _classify_nodes(self, snapshot=None):
         """
-        Detect nodes with high resource utilization
+        Classify online, non-excluded nodes by load in a single pass
         
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
         Returns:
-            list: Names of overloaded nodes
+            tuple: Lists of overloaded, underloaded and normal node names
         """
         overloaded_nodes = []
-        nodes_usage = self.proxmox_api.get_resource_usage()
+        underloaded_nodes = []
+        normal_nodes = []
+        if snapshot:
+            nodes_usage = snapshot.nodes_usage
+        else:
+            nodes_usage = self.proxmox_api.get_resource_usage()
         
         if not nodes_usage:
-            return []
-            
-        for node in nodes_usage:
-            if node['status'] != 'online':
-                continue
-                
-            # Check if node is in exclusion list
-            if node['name'] in self.config["node_exclusions"]:
-                continue
-                
-            # Check CPU and memory usage against high load threshold
-            cpu_usage = node['cpu']['usage']
-            memory_usage = node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 0
+            return overloaded_nodes, underloaded_nodes, normal_nodes
+        
+        # Skip offline nodes and nodes in the exclusion list
+        node_exclusions = self.config["node_exclusions"]
+        nodes = [node for node in nodes_usage
+                 if node['status'] == 'online' and node['name'] not in node_exclusions]
+        
+        if not nodes:
+            return overloaded_nodes, underloaded_nodes, normal_nodes
+        
+        # Lay out the metrics as arrays so thresholds are checked for all nodes at once
+        count = len(nodes)
+        names = np.array([node['name'] for node in nodes], dtype=object)
+        cpu_usage = np.fromiter((node['cpu']['usage'] for node in nodes), dtype=float, count=count)
+        memory_used = np.fromiter((node['memory']['used'] for node in nodes), dtype=float, count=count)
+        memory_total = np.fromiter((node['memory']['total'] for node in nodes), dtype=float, count=count)
+        memory_usage = np.divide(memory_used, memory_total, out=np.zeros(count), where=memory_total > 0)
+        
+        high_threshold = self.config["high_load_threshold"]
+        low_threshold = self.config["low_load_threshold"]
+        overloaded = (cpu_usage > high_threshold) | (memory_usage > high_threshold)
+        underloaded = ~overloaded & (cpu_usage < low_threshold) & (memory_usage < low_threshold)
+        normal = ~(overloaded | underloaded)
+        
+        return names[overloaded].tolist(), names[underloaded].tolist(), names[normal].tolist()
+    
+    def detect_overloaded_nodes(self, snapshot=None):
+        """
+        Detect nodes with high resource utilization
+        
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
             
-            if cpu_usage > self.config["high_load_threshold"] or memory_usage > self.config["high_load_threshold"]:
-                overloaded_nodes.append(node['name'])
-                
-        return overloaded_nodes
+        Returns:
+            list: Names of overloaded nodes
+        """
+        return self._classify_nodes(snapshot)[0]
     
-    def detect_underloaded_nodes(self):
+    def detect_underloaded_nodes(self, snapshot=None):
         """
         Detect nodes with low resource utilization
         
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
         Returns:
             list: Names of underloaded nodes
         """
-        underloaded_nodes = []
-        nodes_usage = self.proxmox_api.get_resource_usage()
-        
-        if not nodes_usage:
-            return []
-            
-        for node in nodes_usage:
-            if node['status'] != 'online':
-                continue
-                
-            # Check if node is in exclusion list
-            if node['name'] in self.config["node_exclusions"]:
-                continue
-                
-            # Check CPU and memory usage against low load threshold
-            cpu_usage = node['cpu']['usage']
-            memory_usage = node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 0
-            
-            if cpu_usage < self.config["low_load_threshold"] and memory_usage < self.config["low_load_threshold"]:
-                underloaded_nodes.append(node['name'])
-                
-        return underloaded_nodes
+        return self._classify_nodes(snapshot)[1]
     
-    def identify_vms_to_migrate(self, node_name, count=2):
+    def identify_vm_candidates(self, node_name, count=2, snapshot=None, off_hours=None):
         """
         Identify VMs on a node that are good candidates for migration
         
         Args:
             node_name (str): Name of the node
             count (int): Maximum number of VMs to select
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            off_hours (bool, optional): Result of _is_off_hours() if already computed
             
         Returns:
-            list: List of VM IDs to migrate
+            list: VM entries from the node's VM list, best candidates first
         """
-        vms = self.proxmox_api.get_node_vms(node_name)
+        if snapshot:
+            vms = snapshot.get_node_vms(node_name)
+        else:
+            vms = self.proxmox_api.get_node_vms(node_name)
         if not vms:
             return []
             
+        # The time of day is the same for every VM on the node
+        if off_hours is None and self.config["consider_time_of_day"]:
+            off_hours = self._is_off_hours()
+        
         # Filter out VMs that shouldn't be migrated
         eligible_vms = []
         for vm in vms:
@@ -326,7 +876,7 @@ class LoadBalancer:
                 continue
                 
             # Check if migration is allowed
-            if not self._is_migration_allowed(vm_id):
+            if not self._is_migration_allowed(vm_id, off_hours):
                 continue
                 
             # Add to eligible list
@@ -335,109 +885,182 @@ class LoadBalancer:
         if not eligible_vms:
             return []
             
-        # Sort VMs by resource usage (highest first)
-        # This is a simple heuristic - we migrate the most resource-intensive VMs first
-        sorted_vms = sorted(eligible_vms, key=lambda x: x.get('cpu', 0), reverse=True)
+        # Sort VMs by volume-to-size ratio (highest first), as in Sandpiper:
+        # the VMs that shed the most load per byte of memory to copy go first
+        cpu = np.array([vm.get('cpu', 0) for vm in eligible_vms], dtype=float)
+        mem = np.array([vm.get('mem', 0) for vm in eligible_vms], dtype=float)
+        maxmem = np.array([vm.get('maxmem', 0) for vm in eligible_vms], dtype=float)
+        mem_ratio = np.divide(mem, maxmem, out=np.zeros_like(mem), where=maxmem > 0)
+        
+        volume = 1 / (np.clip(1 - cpu, 1e-3, 1) * np.clip(1 - mem_ratio, 1e-3, 1))
+        size = np.where(mem > 0, mem, maxmem)
+        vsr = volume / np.maximum(size, 1)
         
-        # Return VM IDs
-        return [vm['vmid'] for vm in sorted_vms[:count]]
+        order = np.argsort(-vsr, kind='stable')[:count]
+        return [eligible_vms[i] for i in order]
+    
+    def identify_vms_to_migrate(self, node_name, count=2, snapshot=None):
+        """
+        Identify VMs on a node that are good candidates for migration
+        
+        Args:
+            node_name (str): Name of the node
+            count (int): Maximum number of VMs to select
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
+        Returns:
+            list: List of VM IDs to migrate
+        """
+        return [vm['vmid'] for vm in self.identify_vm_candidates(node_name, count, snapshot)]
+    
+    def _get_vm_details(self, node_name, vm_info):
+        """
+        Get the VM details needed to plan a migration
+        
+        The node VM list already carries status, name, usage and allocated
+        resources, so the VM status is only queried if Proxmox left them out.
+        
+        Args:
+            node_name (str): Node the VM runs on
+            vm_info (dict): VM entry from the node's VM list
+            
+        Returns:
+            dict: VM details, or None if the VM status could not be retrieved
+        """
+        if all(field in vm_info for field in ('status', 'cpus', 'maxmem', 'maxdisk')):
+            return vm_info
+        return self.proxmox_api.get_vm_status(node_name, vm_info['vmid'])
     
-    def balance_cluster(self):
+    def _pick_target_node(self, target_nodes, excluded_nodes, vm_requirements, snapshot):
+        """
+        Pick the best node of a strategy's target list for a VM
+        
+        Args:
+            target_nodes (list): Candidate node names
+            excluded_nodes (list): Node names that must not be picked
+            vm_requirements (dict): VM requirements for cpu, memory, disk
+            snapshot (_ClusterSnapshot): Cluster state of the current cycle
+            
+        Returns:
+            str: Name of the best candidate, or None if none can host the VM
+        """
+        candidates = [node for node in target_nodes if node not in excluded_nodes]
+        if not candidates:
+            return None
+        
+        closeness = self.node_selector.score_all(
+            candidates, vm_requirements, nodes=snapshot.nodes, nodes_usage=snapshot.nodes_usage)
+        best = int(np.argmax(closeness))
+        return candidates[best] if closeness[best] >= 0 else None
+    
+    def create_snapshot(self):
+        """
+        Create a point-in-time view of the cluster backed by the balancer's thread pool
+        
+        Returns:
+            _ClusterSnapshot: Snapshot that fetches and caches Proxmox API data on demand
+        """
+        return _ClusterSnapshot(self.proxmox_api, self._executor)
+    
+    def _fetch_vm_statuses(self, vm_locations):
+        """
+        Get the status of several VMs, querying Proxmox in parallel
+        
+        Args:
+            vm_locations (list): (node name, VM ID) pairs
+            
+        Returns:
+            list: VM status for each pair, None where it could not be retrieved
+        """
+        if len(vm_locations) < 2:
+            return [self.proxmox_api.get_vm_status(node, vm_id) for node, vm_id in vm_locations]
+        return list(self._executor.map(lambda location: self.proxmox_api.get_vm_status(*location),
+                                       vm_locations))
+    
+    def balance_cluster(self, snapshot=None):
         """
         Perform load balancing across the cluster
         
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
         Returns:
             bool: Whether any migrations were performed
         """
         logger.info("Starting cluster balance check")
         
+        # Share API responses and the time-of-day check across all steps of this cycle
+        if snapshot is None:
+            snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+        off_hours = self._is_off_hours() if self.config["consider_time_of_day"] else None
+        
+        # Nodes joining, leaving or changing status count as a cluster change
+        node_states = {node['node']: node['status'] for node in snapshot.nodes}
+        if node_states:
+            if self._last_node_states is not None and node_states != self._last_node_states:
+                self.on_cluster_change({"type": "node_status", "nodes": node_states})
+            self._last_node_states = node_states
+        
         # Check for migrations in progress
         current_migrations = self.proxmox_api.get("cluster/tasks?running=1") or []
-        migration_tasks = [task for task in current_migrations if task.get('type') == 'qmigrate']
+        max_parallel_migrations = self.config["max_parallel_migrations"]
+        running_migrations = 0
+        for task in current_migrations:
+            if task.get('type') == 'qmigrate':
+                running_migrations += 1
+                # No need to count further once the limit is reached
+                if running_migrations >= max_parallel_migrations:
+                    break
         
-        if len(migration_tasks) >= self.config["max_parallel_migrations"]:
-            logger.info(f"Skipping balance: {len(migration_tasks)} migrations already in progress")
+        if running_migrations >= max_parallel_migrations:
+            logger.info("Skipping balance: %d migrations already in progress", running_migrations)
             return False
         
-        # Step 1: Detect overloaded nodes
-        overloaded_nodes = self.detect_overloaded_nodes()
-        logger.info(f"Overloaded nodes: {overloaded_nodes}")
+        # Nothing to do if the cluster looks exactly like in the last idle cycle
+        snapshot_hash = self._snapshot_hash(snapshot, off_hours, running_migrations)
+        if snapshot_hash is not None and snapshot_hash == self._last_snapshot_hash:
+            logger.info("No change in the cluster since the last balance check")
+            self._run_periodic_tasks()
+            return False
         
-        # Step 2: Detect underloaded nodes
-        underloaded_nodes = self.detect_underloaded_nodes()
-        logger.info(f"Underloaded nodes: {underloaded_nodes}")
+        # Step 1: Detect overloaded and underloaded nodes
+        overloaded_nodes, underloaded_nodes, _ = self._classify_nodes(snapshot)
+        logger.info("Overloaded nodes: %s", overloaded_nodes)
+        logger.info("Underloaded nodes: %s", underloaded_nodes)
         
-        # Step 3: For each overloaded node, migrate VMs to less loaded nodes
+        # Step 2: For each overloaded node, migrate VMs to less loaded nodes
         migrations_performed = 0
-        migrations_allowed = self.config["max_parallel_migrations"] - len(migration_tasks)
-        
-        # Define a rebalance strategy
-        strategies = []
-        
-        # Strategy 1: Migrate from overloaded to underloaded nodes (if enabled)
-        if self.config["migrate_high_load"] and overloaded_nodes and migrations_allowed > 0:
-            strategies.append(("high_to_low", overloaded_nodes, underloaded_nodes))
+        migrations_attempted = 0
+        migrations_allowed = max_parallel_migrations - running_migrations
         
-        # Strategy 2: Distribute load evenly if no overloaded nodes but underloaded nodes exist
-        if not overloaded_nodes and underloaded_nodes and migrations_allowed > 0:
-            # Find nodes with normal load but not underloaded
-            all_nodes = [n['node'] for n in self.proxmox_api.get_nodes() if 
-                        n['status'] == 'online' and 
-                        n['node'] not in underloaded_nodes and
-                        n['node'] not in self.config["node_exclusions"]]
-            
-            if all_nodes:
-                strategies.append(("distribution", all_nodes, underloaded_nodes))
-        
-        # Strategy 3: Implement VM affinity if enabled
-        if self.config["consider_affinity"] and self.config["vm_groups"] and migrations_allowed > 0:
-            # Find VM groups that are split across nodes and try to consolidate them
-            for group_name, group_vms in self.config["vm_groups"].items():
-                if len(group_vms) < 2:
-                    continue
-                    
-                # Find current location of these VMs
-                vm_locations = {}
-                for vm_id in group_vms:
-                    for node in self.proxmox_api.get_nodes():
-                        if node['status'] != 'online':
-                            continue
-                            
-                        node_vms = self.proxmox_api.get_node_vms(node['node']) or []
-                        if any(vm['vmid'] == int(vm_id) for vm in node_vms):
-                            vm_locations[vm_id] = node['node']
-                            break
-                
-                # If VMs are split across nodes, add a consolidation strategy
-                if len(set(vm_locations.values())) > 1:
-                    # Find the node with most VMs from this group
-                    node_counts = {}
-                    for node in vm_locations.values():
-                        node_counts[node] = node_counts.get(node, 0) + 1
-                    
-                    target_node = max(node_counts.items(), key=lambda x: x[1])[0]
-                    source_nodes = [node for node in vm_locations.values() if node != target_node]
-                    
-                    strategies.append(("affinity", source_nodes, [target_node]))
+        # Strategies are built lazily, so later ones (affinity discovery scans every
+        # node) are skipped once the earlier ones use up the migration budget
+        strategies = self._iter_strategies(snapshot, overloaded_nodes, underloaded_nodes)
         
         # Execute each strategy in order
-        for strategy_name, source_nodes, target_nodes in strategies:
-            if migrations_performed >= migrations_allowed:
+        while migrations_performed < migrations_allowed:
+            strategy = next(strategies, None)
+            if strategy is None:
                 break
+            strategy_name, source_nodes, target_nodes = strategy
                 
-            logger.info(f"Executing {strategy_name} migration strategy")
+            logger.info("Executing %s migration strategy", strategy_name)
             
             for source_node in source_nodes:
                 if migrations_performed >= migrations_allowed:
                     break
                     
                 # Find VMs to migrate
-                vms_to_migrate = self.identify_vms_to_migrate(source_node, 
-                                                            count=migrations_allowed - migrations_performed)
+                vm_candidates = self.identify_vm_candidates(source_node, 
+                                                            count=migrations_allowed - migrations_performed,
+                                                            snapshot=snapshot,
+                                                            off_hours=off_hours)
                 
-                for vm_id in vms_to_migrate:
+                for vm_info in vm_candidates:
+                    vm_id = vm_info['vmid']
+                    
                     # Get VM info to determine requirements
-                    vm_status = self.proxmox_api.get_vm_status(source_node, vm_id)
+                    vm_status = self._get_vm_details(source_node, vm_info)
                     if not vm_status:
                         continue
                         
@@ -448,25 +1071,11 @@ class LoadBalancer:
                     
                     # For affinity strategies, restrict to the target node
                     if strategy_name == "affinity":
-                        best_node = None
-                        for node in target_nodes:
-                            if node not in excluded_nodes:
-                                # Check if this node can accept the VM
-                                node_score = self.node_selector.calculate_node_score(node, vm_requirements)
-                                if node_score < float('inf'):
-                                    best_node = node
-                                    break
+                        best_node = self._pick_target_node(target_nodes, excluded_nodes, vm_requirements, snapshot)
                     # For other strategies
                     elif target_nodes:
                         # Try to find a good target node from our target list first
-                        best_node = None
-                        for node in target_nodes:
-                            if node not in excluded_nodes:
-                                # Check if this node can accept the VM
-                                node_score = self.node_selector.calculate_node_score(node, vm_requirements)
-                                if node_score < float('inf'):
-                                    best_node = node
-                                    break
+                        best_node = self._pick_target_node(target_nodes, excluded_nodes, vm_requirements, snapshot)
                         
                         # If no suitable node found in target list, try any node
                         if not best_node:
@@ -478,24 +1087,22 @@ class LoadBalancer:
                     if best_node:
                         # Apply VM-specific options if migrating a VM in a VM group
                         vm_options = {}
-                        is_in_group = False
-                        for group_name, group_vms in self.config["vm_groups"].items():
-                            if str(vm_id) in group_vms or int(vm_id) in group_vms:
-                                is_in_group = True
-                                # Priority migrations for VMs in groups
-                                vm_options = {"priority": "high"}
-                                break
+                        is_in_group = _norm_vmid(vm_id) in self._vm_group_index
+                        if is_in_group:
+                            # Priority migrations for VMs in groups
+                            vm_options = {"priority": "high"}
                         
                         # Perform migration
-                        logger.info(f"Migrating VM {vm_id} from {source_node} to {best_node} (strategy: {strategy_name})")
+                        logger.info("Migrating VM %s from %s to %s (strategy: %s)", vm_id, source_node, best_node, strategy_name)
                         
                         # Set online migration depending on VM status
                         online = vm_status.get('status') == 'running'
                         
+                        migrations_attempted += 1
                         result = self.proxmox_api.migrate_vm(source_node, vm_id, best_node, online=online)
                         
                         if result:
-                            logger.info(f"Migration of VM {vm_id} initiated successfully")
+                            logger.info("Migration of VM %s initiated successfully", vm_id)
                             self.last_balance_time[vm_id] = time.time()
                             
                             # Record migration for learning
@@ -509,44 +1116,170 @@ class LoadBalancer:
                                 'vm_name': vm_status.get('name', f'VM-{vm_id}'),
                                 'result': 'initiated'
                             }
-                            self.migration_history.append(migration_record)
+                            self.record_migration(migration_record)
                             
                             # Add to VM performance history
                             if vm_id not in self.vm_performance_history:
-                                self.vm_performance_history[vm_id] = []
+                                self.vm_performance_history[vm_id] = _VMHistory()
                             
-                            self.vm_performance_history[vm_id].append({
-                                'timestamp': time.time(),
-                                'cpu': vm_status.get('cpu', 0),
-                                'memory_used': vm_status.get('mem', 0),
-                                'node': source_node
-                            })
+                            self.vm_performance_history[vm_id].append(
+                                vm_status.get('cpu', 0), vm_status.get('mem', 0), source_node)
                             
                             migrations_performed += 1
                             if migrations_performed >= migrations_allowed:
                                 break
                         else:
-                            logger.error(f"Failed to migrate VM {vm_id} from {source_node} to {best_node}")
+                            logger.error("Failed to migrate VM %s from %s to %s", vm_id, source_node, best_node)
                 
                 if migrations_performed >= migrations_allowed:
                     break
         
+        # Only an idle cycle may be skipped next time, a failed migration is retried
+        self._last_snapshot_hash = snapshot_hash if migrations_attempted == 0 else None
+        
+        self._run_periodic_tasks()
+        
+        # Return True if any migrations were performed
+        return migrations_performed > 0
+    
+    def _iter_strategies(self, snapshot, overloaded_nodes, underloaded_nodes):
+        """
+        Yield the rebalance strategies for this cycle in order of priority
+        
+        Args:
+            snapshot (_ClusterSnapshot): Cluster state of the current cycle
+            overloaded_nodes (list): Names of the overloaded nodes
+            underloaded_nodes (list): Names of the underloaded nodes
+            
+        Yields:
+            tuple: (strategy name, source node names, target node names)
+        """
+        # Strategy 1: Migrate from overloaded to underloaded nodes (if enabled)
+        if self.config["migrate_high_load"] and overloaded_nodes:
+            yield ("high_to_low", overloaded_nodes, underloaded_nodes)
+        
+        # Strategy 2: Distribute load evenly if no overloaded nodes but underloaded nodes exist
+        if not overloaded_nodes and underloaded_nodes:
+            # Find nodes with normal load but not underloaded
+            all_nodes = [n['node'] for n in snapshot.nodes if 
+                        n['status'] == 'online' and 
+                        n['node'] not in underloaded_nodes and
+                        n['node'] not in self.config["node_exclusions"]]
+            
+            if all_nodes:
+                yield ("distribution", all_nodes, underloaded_nodes)
+        
+        # Strategy 3: Implement VM affinity if enabled
+        if self.config["consider_affinity"] and self.config["vm_groups"]:
+            yield from self._affinity_strategies(snapshot)
+    
+    def _affinity_strategies(self, snapshot):
+        """
+        Yield a consolidation strategy for each VM group split across nodes
+        
+        Args:
+            snapshot (_ClusterSnapshot): Cluster state of the current cycle
+            
+        Yields:
+            tuple: ("affinity", source node names, [target node name])
+        """
+        for group_name, group_vms in self._vm_group_ids.items():
+            if len(group_vms) < 2:
+                continue
+                
+            # Find current location of these VMs
+            vm_locations = {}
+            for vm_id in group_vms:
+                node_name = snapshot.vm_locations.get(vm_id)
+                if node_name:
+                    vm_locations[vm_id] = node_name
+            
+            # If VMs are split across nodes, add a consolidation strategy
+            if len(set(vm_locations.values())) > 1:
+                # Find the node with most VMs from this group
+                node_counts = Counter(vm_locations.values())
+                
+                target_node = max(node_counts.items(), key=lambda x: x[1])[0]
+                source_nodes = [node for node in vm_locations.values() if node != target_node]
+                
+                yield ("affinity", source_nodes, [target_node])
+    
+    def _snapshot_hash(self, snapshot, off_hours, running_migrations):
+        """
+        Fingerprint the cluster state that balance_cluster's decisions depend on
+        
+        Node usage is rounded to 1% so that noise does not defeat the comparison.
+        
+        Args:
+            snapshot (_ClusterSnapshot): Cluster state of the current cycle
+            off_hours (bool): Result of _is_off_hours() for this cycle
+            running_migrations (int): Number of migrations in progress
+            
+        Returns:
+            int: Hash of the state, or None if it could not be retrieved
+        """
+        nodes_usage = snapshot.nodes_usage
+        if not nodes_usage:
+            return None
+        
+        node_bins = tuple(sorted(
+            (node['name'], node['status'], round(node['cpu']['usage'] * 100),
+             round(node['memory']['used'] * 100 / node['memory']['total']) if node['memory']['total'] > 0 else 100)
+            for node in nodes_usage
+        ))
+        running_vms = tuple(sorted(
+            (vm['vmid'], node_name) for node_name, vm in snapshot.iter_vms(running_only=True)
+        ))
+        # VMs leaving their post-migration cool-down become eligible again
+        now = time.time()
+        min_interval = self.config["min_balance_interval"]
+        cooling_down = sum(1 for t in self.last_balance_time.values() if now - t < min_interval)
+        
+        return hash((node_bins, running_vms, off_hours, running_migrations, cooling_down))
+    
+    def _run_periodic_tasks(self):
+        """Run the housekeeping that follows every balance cycle"""
         # Check if we need to update critical VMs list
         if self.config.get("auto_identify_critical_vms", False):
             now = time.time()
             last_update = self.config.get("last_critical_vms_update", 0)
-            if now - last_update > 86400:  # Update once a day
+            if self._critical_vms_dirty or now - last_update > 86400:  # Update once a day or after a cluster change
                 logger.info("Auto-updating critical VMs list")
                 self.update_critical_vms()
+                self._critical_vms_dirty = False
                 self.config["last_critical_vms_update"] = now
-                self.save_config()
+                self._mark_config_dirty()
         
         # Learn from migrations if enabled
         if self.config["learning_enabled"] and self.migration_history:
             self.learn_from_migrations()
         
-        # Return True if any migrations were performed
-        return migrations_performed > 0
+        self.flush_config()
+    
+    def _cached_report(self, key, build):
+        """
+        Reuse a recently built report, so concurrent pollers share one computation
+        
+        Only one thread rebuilds a given report, others wait and then read the fresh copy.
+        
+        Args:
+            key (hashable): Identifies the report and its options
+            build (callable): Builds the report when the cached copy is missing or stale
+            
+        Returns:
+            dict: Report built at most "report_cache_ttl" seconds ago
+        """
+        ttl = self.config.get("report_cache_ttl", 0)
+        if ttl <= 0:
+            return build()
+        
+        with self._report_locks.setdefault(key, threading.Lock()):
+            entry = self._report_cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                return entry[1]
+            report = build()
+            self._report_cache[key] = (time.monotonic(), report)
+            return report
     
     def get_status(self):
         """
@@ -555,12 +1288,31 @@ class LoadBalancer:
         Returns:
             dict: Status information
         """
+        return self._cached_report('status', self._build_status)
+    
+    def _build_status(self):
+        """Build the status returned by get_status()"""
+        snapshot = self.create_snapshot()
+        overloaded_nodes, underloaded_nodes, _ = self._classify_nodes(snapshot)
+        
+        # Cluster-wide usage statistics over the online nodes
+        online_nodes = [node for node in snapshot.nodes_usage if node['status'] == 'online']
+        memory_usage = _safe_ratios([node['memory']['used'] for node in online_nodes],
+                                    [node['memory']['total'] for node in online_nodes])
+        disk_usage = _safe_ratios([node['disk']['used'] for node in online_nodes],
+                                  [node['disk']['total'] for node in online_nodes])
+        
         return {
             'running': self.running,
             'config': self.config,
-            'migration_history': self.migration_history[-10:],  # Last 10 migrations
-            'overloaded_nodes': self.detect_overloaded_nodes(),
-            'underloaded_nodes': self.detect_underloaded_nodes()
+            'migration_history': self.get_migration_history(10),  # Last 10 migrations
+            'overloaded_nodes': overloaded_nodes,
+            'underloaded_nodes': underloaded_nodes,
+            'cluster': {
+                'cpu': _describe([node['cpu']['usage'] for node in online_nodes]),
+                'memory': _describe(memory_usage),
+                'disk': _describe(disk_usage)
+            }
         }
     
     def learn_from_migrations(self):
@@ -572,26 +1324,23 @@ class LoadBalancer:
         # would use machine learning to analyze patterns and outcomes
         
         # Analyze recent migrations for patterns in successful vs failed migrations
-        recent_migrations = self.migration_history[-50:]  # Look at last 50 migrations
+        recent_migrations = self.get_migration_history(50)  # Look at last 50 migrations
         
-        # Group by source and target nodes
-        node_pairs = {}
+        # Count migrations and successes per (source, target) node pair in one pass
+        # Migrations that haven't completed yet are assumed to succeed
+        pair_counts = Counter()
+        pair_successes = Counter()
         for migration in recent_migrations:
-            source = migration['source_node']
-            target = migration['target_node']
-            key = f"{source}:{target}"
-            
-            if key not in node_pairs:
-                node_pairs[key] = {'count': 0, 'success': 0}
-                
-            node_pairs[key]['count'] += 1
-            # We would need to track migration success/failure in a real implementation
-            # Here we'll assume all migrations were successful
-            node_pairs[key]['success'] += 1
+            key = (migration['source_node'], migration['target_node'])
+            pair_counts[key] += 1
+            if migration.get('result') != 'failed':
+                pair_successes[key] += 1
         
-        # Calculate success rates
-        for pair, stats in node_pairs.items():
-            stats['success_rate'] = stats['success'] / stats['count'] if stats['count'] > 0 else 0
+        # Report the success rate of each node pair
+        if logger.isEnabledFor(logging.DEBUG):
+            for (source, target), count in pair_counts.items():
+                logger.debug("Migrations %s -> %s: %d/%d succeeded (%.0f%%)", source, target,
+                             pair_successes[(source, target)], count, pair_successes[(source, target)] * 100 / count)
             
         # Use this information to adjust weights or thresholds
         # This is just a placeholder for a more sophisticated implementation
@@ -613,33 +1362,36 @@ class LoadBalancer:
         # Get overloaded nodes
         overloaded_nodes = self.detect_overloaded_nodes()
         
-        # For each overloaded node, recommend VM migrations
+        # For each overloaded node, collect the VMs to migrate
+        candidates = []
         for node in overloaded_nodes:
-            vms_to_migrate = self.identify_vms_to_migrate(node, count=3)
+            vm_candidates = self.identify_vm_candidates(node, count=3)
             
-            for vm_id in vms_to_migrate:
+            for vm_info in vm_candidates:
                 # Get VM details
-                vm_status = self.proxmox_api.get_vm_status(node, vm_id)
+                vm_status = self._get_vm_details(node, vm_info)
                 if not vm_status:
                     continue
                     
-                vm_requirements = self._get_vm_requirements(vm_status)
-                
-                # Get top 3 recommended target nodes
-                excluded_nodes = [node] + self.config["node_exclusions"]
-                target_nodes = self.node_selector.get_node_recommendations(count=3, vm_requirements=vm_requirements)
-                
-                # Filter out excluded nodes
-                target_nodes = [n for n in target_nodes if n not in excluded_nodes]
-                
-                if target_nodes:
-                    recommendations['migrations'].append({
-                        'vm_id': vm_id,
-                        'source_node': node,
-                        'target_nodes': target_nodes,
-                        'vm_name': vm_status.get('name', f'VM-{vm_id}'),
-                        'requirements': vm_requirements
-                    })
+                candidates.append((node, vm_info['vmid'], vm_status, self._get_vm_requirements(vm_status)))
+        
+        # Get top 3 recommended target nodes of all VMs from a single ranking
+        all_targets = self.node_selector.get_node_recommendations_for(
+            [vm_requirements for _, _, _, vm_requirements in candidates], count=3)
+        
+        for (node, vm_id, vm_status, vm_requirements), target_nodes in zip(candidates, all_targets):
+            # Filter out excluded nodes
+            excluded_nodes = [node] + self.config["node_exclusions"]
+            target_nodes = [n for n in target_nodes if n not in excluded_nodes]
+            
+            if target_nodes:
+                recommendations['migrations'].append({
+                    'vm_id': vm_id,
+                    'source_node': node,
+                    'target_nodes': target_nodes,
+                    'vm_name': vm_status.get('name', f'VM-{vm_id}'),
+                    'requirements': vm_requirements
+                })
         
         # Get status for all nodes
         nodes_usage = self.proxmox_api.get_resource_usage()
@@ -654,20 +1406,40 @@ class LoadBalancer:
         
         return recommendations
     
-    def check_and_configure_proxmox(self):
+    def on_cluster_change(self, event=None):
+        """
+        Notify the load balancer that the cluster membership or HA state changed
+        
+        The Proxmox configuration check and the critical VM update then run on the
+        next balance cycle instead of waiting for their periodic interval.
+        
+        Args:
+            event (dict, optional): Description of the change, used for logging
+        """
+        logger.info("Cluster change detected: %s", event)
+        self._proxmox_config_dirty = True
+        self._critical_vms_dirty = True
+        self._last_snapshot_hash = None
+    
+    def check_and_configure_proxmox(self, force=False):
         """
         Check if Proxmox is correctly configured for load balancing and configure it if needed
         
+        Args:
+            force (bool): Check even if the check interval has not elapsed
+            
         Returns:
             dict: Status of Proxmox configuration
         """
         # Check if we should recheck Proxmox configuration
         current_time = time.time()
-        if (current_time - self.config.get("last_proxmox_config_check", 0) < 
+        if (not force and current_time - self.config.get("last_proxmox_config_check", 0) < 
             self.config["proxmox_config"].get("check_proxmox_config_interval", 86400)):
             logger.debug("Skipping Proxmox config check, already checked recently")
             return {"status": "skipped", "message": "Already checked recently"}
         
+        self._proxmox_config_dirty = False
+        
         logger.info("Checking Proxmox configuration for load balancing")
         
         # Check current configuration status
@@ -684,7 +1456,8 @@ class LoadBalancer:
         if not needs_config:
             logger.info("Proxmox is already properly configured for load balancing")
             self.config["last_proxmox_config_check"] = current_time
-            self.save_config()
+            self._mark_config_dirty()
+            self.flush_config()
             return {"status": "already_configured", "message": "Proxmox is already properly configured"}
         
         # Configure Proxmox automatically
@@ -706,25 +1479,18 @@ class LoadBalancer:
             
             # Try to enable HA for critical VMs
             if configure_ha and "critical_vms" in proxmox_config and proxmox_config["critical_vms"]:
+                # Walk the cluster once to find which node each VM is on
+                vm_locations = _ClusterSnapshot(self.proxmox_api, self._executor).vm_locations
                 for vm_id in proxmox_config["critical_vms"]:
-                    # First, find which node this VM is on
-                    nodes = self.proxmox_api.get_nodes()
-                    vm_node = None
-                    for node in nodes:
-                        if node['status'] != 'online':
-                            continue
-                        node_vms = self.proxmox_api.get_node_vms(node['node']) or []
-                        if any(vm['vmid'] == int(vm_id) for vm in node_vms):
-                            vm_node = node['node']
-                            break
-                    
+                    vm_node = vm_locations.get(vm_id)
                     if vm_node:
                         logger.info(f"Enabling HA for critical VM {vm_id} on node {vm_node}")
                         self.proxmox_api.enable_vm_ha(vm_node, vm_id, ha_group_name)
             
             # Update last check time
             self.config["last_proxmox_config_check"] = current_time
-            self.save_config()
+            self._mark_config_dirty()
+            self.flush_config()
             
             logger.info(f"Proxmox auto-configuration completed: {config_result}")
             return {
@@ -737,27 +1503,22 @@ class LoadBalancer:
             logger.error(f"Failed to auto-configure Proxmox: {str(e)}")
             return {"status": "error", "message": f"Error configuring Proxmox: {str(e)}"}
     
-    def identify_critical_vms(self, max_count=5):
+    def identify_critical_vms(self, max_count=5, snapshot=None):
         """
         Identify critical VMs that should have HA enabled
         
         Args:
             max_count (int): Maximum number of VMs to identify
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
             
         Returns:
             list: List of VM IDs identified as critical
         """
-        # Get all VMs in the cluster
-        nodes = self.proxmox_api.get_nodes()
-        all_vms = []
-        for node in nodes:
-            if node['status'] != 'online':
-                continue
-            node_vms = self.proxmox_api.get_node_vms(node['node']) or []
-            for vm in node_vms:
-                if vm['status'] == 'running':
-                    vm['node'] = node['node']
-                    all_vms.append(vm)
+        if snapshot is None:
+            snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+        
+        # Get all running VMs in the cluster, as copies since the VM lists are shared
+        all_vms = [dict(vm, node=node_name) for node_name, vm in snapshot.iter_vms(running_only=True)]
         
         if not all_vms:
             return []
@@ -768,11 +1529,16 @@ class LoadBalancer:
         # A more sophisticated approach would involve analyzing historical
         # workloads, dependencies, and business impact
         
-        # Score VMs based on resources and uptime
+        # Score VMs based on resources and uptime. The node VM list already carries
+        # them, the VM status is only queried for entries that lack a field
+        score_fields = ('cpus', 'maxmem', 'uptime')
+        incomplete = [i for i, vm in enumerate(all_vms) if not all(field in vm for field in score_fields)]
+        fetched_statuses = self._fetch_vm_statuses([(all_vms[i]['node'], all_vms[i]['vmid']) for i in incomplete])
+        statuses = dict(zip(incomplete, fetched_statuses))
+        
         scored_vms = []
-        for vm in all_vms:
-            # Get VM details
-            vm_status = self.proxmox_api.get_vm_status(vm['node'], vm['vmid'])
+        for i, vm in enumerate(all_vms):
+            vm_status = statuses.get(i, vm)
             if not vm_status:
                 continue
             
@@ -791,16 +1557,16 @@ class LoadBalancer:
                 'score': total_score
             })
         
-        # Sort by score (descending)
-        scored_vms.sort(key=lambda x: x['score'], reverse=True)
-        
-        # Return top N VM IDs
-        return [vm['vmid'] for vm in scored_vms[:max_count]]
+        # Return top N VM IDs by score (descending)
+        top_vms = heapq.nlargest(max_count, scored_vms, key=lambda x: x['score'])
+        return [vm['vmid'] for vm in top_vms]
     
     def update_critical_vms(self):
         """
         Update the list of critical VMs in the configuration
         
+        The configuration file is written by the next flush_config().
+        
         Returns:
             bool: Whether the update was successful
         """
@@ -809,30 +1575,29 @@ class LoadBalancer:
             logger.info(f"Identified critical VMs: {critical_vms}")
             
             self.config["proxmox_config"]["critical_vms"] = critical_vms
-            self.save_config()
+            self._index_vm_config()
+            self._mark_config_dirty()
             return True
             
         except Exception as e:
             logger.error(f"Failed to update critical VMs: {str(e)}")
             return False
             
-    def detect_vm_affinity_groups(self):
+    def detect_vm_affinity_groups(self, snapshot=None):
         """
         Detect groups of VMs that should stay together based on network traffic and resource patterns
         
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
         Returns:
             dict: Dictionary of VM groups
         """
+        if snapshot is None:
+            snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+        
         # Get all VMs in the cluster
-        nodes = self.proxmox_api.get_nodes()
-        all_vms = []
-        for node in nodes:
-            if node['status'] != 'online':
-                continue
-            node_vms = self.proxmox_api.get_node_vms(node['node']) or []
-            for vm in node_vms:
-                vm['node'] = node['node']
-                all_vms.append(vm)
+        all_vms = [vm for _, vm in snapshot.iter_vms()]
         
         if not all_vms:
             return {}
@@ -840,7 +1605,7 @@ class LoadBalancer:
         # Group VMs by name patterns
         # This is a simple approach. A more sophisticated approach would
         # analyze network traffic between VMs
-        groups = {}
+        prefix_groups = defaultdict(list)
         
         # Pattern-based grouping
         for vm in all_vms:
@@ -850,17 +1615,13 @@ class LoadBalancer:
                 
             # Extract potential group indicators from name
             # Common patterns: app-db1/app-web1, service-node1/service-node2, etc.
-            parts = name.split('-')
-            if len(parts) >= 2:
-                prefix = parts[0].lower()
-                # Only consider prefixes with at least 2 characters
-                if len(prefix) >= 2:
-                    if prefix not in groups:
-                        groups[prefix] = []
-                    groups[prefix].append(vm['vmid'])
+            # Only prefixes with at least 2 characters are considered
+            match = _NAME_PREFIX_RE.match(name)
+            if match:
+                prefix_groups[sys.intern(match.group(1).lower())].append(vm['vmid'])
         
         # Only keep groups with at least 2 VMs
-        groups = {k: v for k, v in groups.items() if len(v) >= 2}
+        groups = {k: v for k, v in prefix_groups.items() if len(v) >= 2}
         
         # For VMs with performance history, check for correlated resource usage
         if self.vm_performance_history:
@@ -888,65 +1649,48 @@ class LoadBalancer:
         # This is a simplified implementation
         # A more sophisticated approach would use statistical correlation
         correlated_groups = {}
-        group_counter = 0
         
         # We need at least a few VMs with history
         if len(self.vm_performance_history) < 2:
             return correlated_groups
             
-        # Create a VM correlation matrix
-        correlated_pairs = []
+        # Compare the CPU usage patterns of VMs with enough data points
+        vm_ids = [vm_id for vm_id, history in self.vm_performance_history.items() if len(history) >= 5]
+        correlation = self._calculate_correlation_matrix([self.vm_performance_history[vm_id] for vm_id in vm_ids])
         
-        # Compare VM histories
-        vm_ids = list(self.vm_performance_history.keys())
-        for i in range(len(vm_ids)):
-            vm1 = vm_ids[i]
-            history1 = self.vm_performance_history[vm1]
-            
-            if len(history1) < 5:  # Need enough data points
-                continue
-                
-            for j in range(i + 1, len(vm_ids)):
-                vm2 = vm_ids[j]
-                history2 = self.vm_performance_history[vm2]
-                
-                if len(history2) < 5:  # Need enough data points
-                    continue
-                    
-                # Simple correlation: check if CPU usage patterns are similar
-                # This is a very simplistic approach
-                correlation = self._calculate_simple_correlation(history1, history2)
-                
-                if correlation > 0.7:  # High correlation threshold
-                    correlated_pairs.append((vm1, vm2, correlation))
+        # High correlation threshold
+        rows, cols = np.triu_indices(len(vm_ids), k=1)
+        high = correlation[rows, cols] > 0.7
+        rows, cols = rows[high], cols[high]
         
-        # Convert correlated pairs to groups
+        # Sort by correlation strength
+        order = np.argsort(-correlation[rows, cols], kind='stable')
+        correlated_pairs = [(vm_ids[i], vm_ids[j], correlation[i, j])
+                            for i, j in zip(rows[order], cols[order])]
+        
+        # Convert correlated pairs to groups: VMs linked by a chain of
+        # correlated pairs end up in the same group (union-find)
         if correlated_pairs:
-            # Sort by correlation strength
-            correlated_pairs.sort(key=lambda x: x[2], reverse=True)
+            parent = {}
+            
+            def find(vm_id):
+                root = parent.setdefault(vm_id, vm_id)
+                while root != parent[root]:
+                    parent[root] = parent[parent[root]]  # Path halving
+                    root = parent[root]
+                return root
             
-            # Build groups using a simple algorithm
-            grouped_vms = set()
             for vm1, vm2, _ in correlated_pairs:
-                # Check if either VM is already in a group
-                found_group = False
-                for group_name, vm_ids in correlated_groups.items():
-                    if vm1 in vm_ids or vm2 in vm_ids:
-                        # Add the other VM to the group
-                        if vm1 not in vm_ids:
-                            vm_ids.append(vm1)
-                        if vm2 not in vm_ids:
-                            vm_ids.append(vm2)
-                        found_group = True
-                        break
-                
-                # If neither VM is in a group, create a new group
-                if not found_group and (vm1 not in grouped_vms or vm2 not in grouped_vms):
-                    group_counter += 1
-                    group_name = f"correlated_group_{group_counter}"
-                    correlated_groups[group_name] = [vm1, vm2]
-                    grouped_vms.add(vm1)
-                    grouped_vms.add(vm2)
+                root1, root2 = find(vm1), find(vm2)
+                if root1 != root2:
+                    parent[root2] = root1
+            
+            # Groups are numbered in order of their strongest pair
+            components = defaultdict(list)
+            for vm_id in parent:
+                components[find(vm_id)].append(vm_id)
+            for group_counter, vm_ids in enumerate(components.values(), start=1):
+                correlated_groups[f"correlated_group_{group_counter}"] = vm_ids
         
         return correlated_groups
     
@@ -955,46 +1699,61 @@ class LoadBalancer:
         Calculate a simple correlation between two VM usage histories
         
         Args:
-            history1 (list): Usage history for VM 1
-            history2 (list): Usage history for VM 2
+            history1 (_VMHistory): Usage history for VM 1
+            history2 (_VMHistory): Usage history for VM 2
             
         Returns:
             float: Correlation coefficient (-1 to 1)
         """
-        # Extract CPU usage from history
-        cpu1 = [entry.get('cpu', 0) for entry in history1[-10:]]  # Use last 10 entries
-        cpu2 = [entry.get('cpu', 0) for entry in history2[-10:]]
-        
-        # Need at least 3 data points
-        if len(cpu1) < 3 or len(cpu2) < 3:
-            return 0
-            
-        # Calculate means
-        mean1 = sum(cpu1) / len(cpu1)
-        mean2 = sum(cpu2) / len(cpu2)
+        return float(self._calculate_correlation_matrix([history1, history2])[0, 1])
+    
+    def _calculate_correlation_matrix(self, histories):
+        """
+        Calculate the CPU usage correlation between every pair of VM histories
         
-        # Calculate correlation coefficient
-        numerator = sum((cpu1[i] - mean1) * (cpu2[i] - mean2) for i in range(min(len(cpu1), len(cpu2))))
-        denominator1 = sum((x - mean1) ** 2 for x in cpu1)
-        denominator2 = sum((x - mean2) ** 2 for x in cpu2)
+        The last 10 entries of each history are used. Two histories are compared
+        over their most recent common number of entries.
         
-        # Avoid division by zero
-        if denominator1 == 0 or denominator2 == 0:
-            return 0
+        Args:
+            histories (list): Usage histories (_VMHistory)
             
-        correlation = numerator / ((denominator1 * denominator2) ** 0.5)
-        
-        return correlation
+        Returns:
+            np.ndarray: Symmetric matrix of correlation coefficients (-1 to 1),
+                0 for pairs with fewer than 3 common points or a constant usage
+        """
+        # Extract CPU usage from history, last 10 entries
+        cpu = [history.recent('cpu', 10).astype(np.float64) for history in histories]
+        lengths = np.array([len(series) for series in cpu], dtype=int)
+        correlation = np.zeros((len(cpu), len(cpu)))
+        
+        # One corrcoef call per distinct window length
+        for window in np.unique(lengths[lengths >= 3]):
+            indices = np.flatnonzero(lengths >= window)
+            if len(indices) < 2:
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                window_corr = np.corrcoef(np.stack([cpu[i][-window:] for i in indices]))
+            block = np.ix_(indices, indices)
+            uses_window = np.minimum.outer(lengths[indices], lengths[indices]) == window
+            correlation[block] = np.where(uses_window, window_corr, correlation[block])
+        
+        # Constant usage has no defined correlation
+        return np.nan_to_num(correlation, nan=0.0)
     
-    def update_vm_groups(self):
+    def update_vm_groups(self, snapshot=None):
         """
         Update VM groups based on detected affinity
         
+        The configuration file is written by the next flush_config().
+        
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
+            
         Returns:
             bool: Whether the update was successful
         """
         try:
-            detected_groups = self.detect_vm_affinity_groups()
+            detected_groups = self.detect_vm_affinity_groups(snapshot)
             logger.info(f"Detected VM affinity groups: {detected_groups}")
             
             # Merge with existing groups
@@ -1007,7 +1766,8 @@ class LoadBalancer:
             
             # Update configuration
             self.config["vm_groups"] = detected_groups
-            self.save_config()
+            self._index_vm_config()
+            self._mark_config_dirty()
             
             return True
             
@@ -1015,7 +1775,7 @@ class LoadBalancer:
             logger.error(f"Failed to update VM groups: {str(e)}")
             return False
             
-    def analyze_migration_impact(self, vm_id, source_node, target_node):
+    def analyze_migration_impact(self, vm_id, source_node, target_node, snapshot=None, vm_status=None):
         """
         Analyze the potential impact of migrating a VM
         
@@ -1023,6 +1783,8 @@ class LoadBalancer:
             vm_id (int): VM ID to migrate
             source_node (str): Source node name
             target_node (str): Target node name
+            snapshot (_ClusterSnapshot, optional): Cluster state shared by several analyses
+            vm_status (dict, optional): Current status of the VM, if the caller already fetched it
             
         Returns:
             dict: Impact analysis
@@ -1035,7 +1797,8 @@ class LoadBalancer:
         }
         
         # Get VM status
-        vm_status = self.proxmox_api.get_vm_status(source_node, vm_id)
+        if vm_status is None:
+            vm_status = self.proxmox_api.get_vm_status(source_node, vm_id)
         if not vm_status:
             impact['recommended'] = False
             impact['reasons'].append("Unable to get VM status")
@@ -1044,40 +1807,35 @@ class LoadBalancer:
         # Check if VM has performance history
         if vm_id in self.vm_performance_history and len(self.vm_performance_history[vm_id]) > 3:
             # Check if VM has recently had high resource usage
-            recent_history = self.vm_performance_history[vm_id][-3:]
-            avg_cpu = sum(entry.get('cpu', 0) for entry in recent_history) / len(recent_history)
+            avg_cpu = float(self.vm_performance_history[vm_id].recent('cpu', 3).mean())
             
             if avg_cpu > 0.7:  # High CPU usage
                 impact['performance_impact'] = 'medium'
                 impact['risk_level'] = 'medium'
                 impact['reasons'].append("VM has had high CPU usage recently")
         
+        if snapshot is None:
+            snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+        
         # Check if VM is in an affinity group
-        in_group = False
-        for group_name, group_vms in self.config.get("vm_groups", {}).items():
-            if str(vm_id) in group_vms or int(vm_id) in group_vms:
-                in_group = True
-                
-                # Check if other VMs in the group are on the target node
-                group_on_target = False
-                for other_vm in group_vms:
-                    if other_vm != str(vm_id) and other_vm != int(vm_id):
-                        # Check if this VM is on the target node
-                        target_vms = self.proxmox_api.get_node_vms(target_node) or []
-                        if any(vm['vmid'] == int(other_vm) for vm in target_vms):
-                            group_on_target = True
-                            break
-                
-                if group_on_target:
-                    impact['reasons'].append(f"VM is part of affinity group '{group_name}' with VMs on target node")
-                else:
-                    impact['performance_impact'] = 'medium'
-                    impact['reasons'].append(f"VM is part of affinity group '{group_name}' but no other group VMs on target node")
-                
-                break
+        vm_id_int = _norm_vmid(vm_id)
+        group_name = self._vm_group_index.get(vm_id_int)
+        if group_name is not None:
+            group_vms = self._vm_group_ids[group_name]
+            
+            # Check if other VMs in the group are on the target node
+            target_vmids = {vm['vmid'] for vm in snapshot.get_node_vms(target_node)}
+            group_on_target = any(other_vm != vm_id_int and other_vm in target_vmids
+                                  for other_vm in group_vms)
+            
+            if group_on_target:
+                impact['reasons'].append(f"VM is part of affinity group '{group_name}' with VMs on target node")
+            else:
+                impact['performance_impact'] = 'medium'
+                impact['reasons'].append(f"VM is part of affinity group '{group_name}' but no other group VMs on target node")
         
         # Check if target node has enough resources
-        target_status = self.proxmox_api.get_node_status(target_node)
+        target_status = snapshot.get_node_status(target_node)
         if target_status:
             vm_cpu = vm_status.get('cpus', 1)
             vm_memory = vm_status.get('maxmem', 1024 * 1024 * 1024)
@@ -1101,16 +1859,14 @@ class LoadBalancer:
                 impact['reasons'].append("Target node may not have enough memory for this VM")
         
         # Check historical migration success
-        for migration in self.migration_history:
-            if migration['vm_id'] == vm_id and migration['target_node'] == target_node:
-                if migration.get('result') == 'success':
-                    impact['reasons'].append("VM has been successfully migrated to this node before")
-                    break
-                elif migration.get('result') == 'failed':
-                    impact['risk_level'] = 'high'
-                    impact['recommended'] = False
-                    impact['reasons'].append("Previous migration of this VM to this node failed")
-                    break
+        migration = self._migration_index.get((vm_id_int, target_node))
+        if migration:
+            if migration.get('result') == 'success':
+                impact['reasons'].append("VM has been successfully migrated to this node before")
+            elif migration.get('result') == 'failed':
+                impact['risk_level'] = 'high'
+                impact['recommended'] = False
+                impact['reasons'].append("Previous migration of this VM to this node failed")
         
         return impact
     
@@ -1127,6 +1883,11 @@ class LoadBalancer:
             'node_status': base_recommendations['node_status']
         }
         
+        # Target node status and VM lists are fetched once for all recommendations
+        snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+        snapshot.prefetch_node_status(target_node for rec in base_recommendations['migrations']
+                                      for target_node in rec['target_nodes'])
+        
         # Add impact analysis to each recommendation
         for rec in base_recommendations['migrations']:
             vm_id = rec['vm_id']
@@ -1135,7 +1896,7 @@ class LoadBalancer:
             # Analyze impact for each target node
             target_analyses = []
             for target_node in rec['target_nodes']:
-                impact = self.analyze_migration_impact(vm_id, source_node, target_node)
+                impact = self.analyze_migration_impact(vm_id, source_node, target_node, snapshot)
                 target_analyses.append({
                     'node': target_node,
                     'impact_analysis': impact
@@ -1152,18 +1913,90 @@ class LoadBalancer:
         
         return detailed_recommendations
     
+    def record_migration(self, migration_record):
+        """
+        Add a migration to the history
+        
+        Args:
+            migration_record (dict): Migration details, with 'result' set to 'initiated'
+                for a migration whose outcome monitor_migrations() should track
+        """
+        # The history and its per-VM index must change together
+        with self._history_lock:
+            history = self.migration_history
+            if history and len(history) == history.maxlen:
+                # The oldest record is about to be evicted, drop it from the per-VM index too
+                evicted_vm_id = _norm_vmid(history[0]['vm_id'])
+                vm_history = self._history_by_vm[evicted_vm_id]
+                vm_history.popleft()
+                if not vm_history:
+                    del self._history_by_vm[evicted_vm_id]
+            
+            history.append(migration_record)
+            self._history_by_vm[_norm_vmid(migration_record['vm_id'])].append(migration_record)
+            if migration_record.get('result') == 'initiated':
+                self._pending_migrations.append(migration_record)
+        self._report_cache.clear()
+    
+    def resize_migration_history(self):
+        """
+        Apply a changed "migration_history_max" to the migration history
+        
+        The most recent records are kept. Migrations still waiting for a result
+        stay tracked by monitor_migrations() even if their record is dropped.
+        """
+        maxlen = max(1, self.config["migration_history_max"])
+        with self._history_lock:
+            if maxlen == self.migration_history.maxlen:
+                return
+            self.migration_history = deque(self.migration_history, maxlen=maxlen)
+            # Rebuild the per-VM index from the records that were kept
+            self._history_by_vm = defaultdict(deque)
+            for record in self.migration_history:
+                self._history_by_vm[_norm_vmid(record['vm_id'])].append(record)
+        self._report_cache.clear()
+    
+    def get_migration_history(self, limit=0):
+        """
+        Get a copy of the migration history that is safe to iterate
+        
+        Args:
+            limit (int): Maximum number of migrations to return, 0 for all
+            
+        Returns:
+            list: Migration records, oldest first
+        """
+        with self._history_lock:
+            return _last_items(self.migration_history, limit) if limit > 0 else list(self.migration_history)
+    
+    def get_vm_migration_history(self, vm_id, limit=0):
+        """
+        Get the migrations of a single VM without scanning the whole history
+        
+        Args:
+            vm_id (int or str): VM ID
+            limit (int): Maximum number of migrations to return, 0 for all
+            
+        Returns:
+            list: Migration records of the VM, oldest first
+        """
+        with self._history_lock:
+            vm_history = self._history_by_vm.get(_norm_vmid(vm_id))
+            if not vm_history:
+                return []
+            return _last_items(vm_history, limit) if limit > 0 else list(vm_history)
+    
     def monitor_migrations(self):
         """
         Monitor ongoing migrations and track their completion status
         
         This method updates the migration_history with success/failure status
         """
-        if not self.migration_history:
-            return
-        
-        # Find migrations that were initiated but don't have a result yet
-        incomplete_migrations = [m for m in self.migration_history 
-                               if m.get('result') == 'initiated']
+        # Migrations that were initiated but don't have a result yet; the list is
+        # filtered in place so records added meanwhile by record_migration() are kept
+        with self._history_lock:
+            self._pending_migrations[:] = [m for m in self._pending_migrations if m.get('result') == 'initiated']
+            incomplete_migrations = list(self._pending_migrations)
         
         if not incomplete_migrations:
             return
@@ -1171,94 +2004,83 @@ class LoadBalancer:
         # Check cluster tasks to find status of each migration
         all_tasks = self.proxmox_api.get("cluster/tasks") or []
         
+        # Index migration tasks by (source node, VM ID) in one pass
+        migration_tasks = defaultdict(list)
+        for task in all_tasks:
+            if task.get('type') == 'qmigrate':
+                migration_tasks[(task.get('node'), str(task.get('id', '')))].append(task)
+        
         for migration in incomplete_migrations:
             vm_id = migration['vm_id']
             source_node = migration['source_node']
             target_node = migration['target_node']
             
             # Find matching task
-            matching_tasks = [t for t in all_tasks 
-                           if t.get('type') == 'qmigrate' and 
-                           str(vm_id) in t.get('id', '') and
-                           source_node in t.get('id', '')]
+            matching_tasks = migration_tasks.get((source_node, str(vm_id)))
             
             if matching_tasks:
                 # Get most recent matching task
-                task = sorted(matching_tasks, key=lambda t: t.get('starttime', 0), reverse=True)[0]
+                task = max(matching_tasks, key=lambda t: t.get('starttime', 0))
                 
                 if task.get('status') == 'stopped':
                     if task.get('exitstatus') == 'OK':
                         # Migration succeeded
-                        logger.info(f"Migration of VM {vm_id} from {source_node} to {target_node} completed successfully")
+                        logger.info("Migration of VM %s from %s to %s completed successfully", vm_id, source_node, target_node)
                         migration['result'] = 'success'
                         migration['completion_time'] = time.time()
+                        self._migration_index[(_norm_vmid(vm_id), target_node)] = migration
                         
                         # Update VM performance tracking
                         if vm_id in self.vm_performance_history:
-                            self.vm_performance_history[vm_id].append({
-                                'timestamp': time.time(),
-                                'node': target_node,
-                                'migration_success': True
-                            })
+                            self.vm_performance_history[vm_id].node = target_node
                     else:
                         # Migration failed
-                        logger.error(f"Migration of VM {vm_id} from {source_node} to {target_node} failed: {task.get('exitstatus')}")
+                        logger.error("Migration of VM %s from %s to %s failed: %s", vm_id, source_node, target_node, task.get('exitstatus'))
                         migration['result'] = 'failed'
                         migration['completion_time'] = time.time()
                         migration['error'] = task.get('exitstatus', 'Unknown error')
+                        self._migration_index[(_norm_vmid(vm_id), target_node)] = migration
                         
                         # Update VM performance tracking
                         if vm_id in self.vm_performance_history:
-                            self.vm_performance_history[vm_id].append({
-                                'timestamp': time.time(),
-                                'node': source_node,
-                                'migration_success': False
-                            })
+                            self.vm_performance_history[vm_id].node = source_node
+            elif time.time() - migration.get('timestamp', 0) > self.config["migration_timeout"]:
+                # The task never showed up in the cluster task list, stop waiting for it
+                logger.warning("No task found for the migration of VM %s from %s to %s, giving up on it",
+                               vm_id, source_node, target_node)
+                migration['result'] = 'expired'
+                migration['completion_time'] = time.time()
     
-    def periodic_update_resources(self):
+    def periodic_update_resources(self, snapshot=None):
         """
         Periodically update resource usage patterns for all nodes and VMs
         This allows the load balancer to make better predictions
+        
+        Args:
+            snapshot (_ClusterSnapshot, optional): Cluster state of the current cycle
         """
         try:
+            if snapshot is None:
+                snapshot = _ClusterSnapshot(self.proxmox_api, self._executor)
+            
             # Update node selector's resource history
             self.node_selector.update_resource_history()
             
-            # Update VM resource history
-            nodes = self.proxmox_api.get_nodes()
-            for node in nodes:
-                if node['status'] != 'online':
+            # Update VM resource history of all running VMs
+            running_vms = [(node_name, vm['vmid']) for node_name, vm in snapshot.iter_vms(running_only=True)]
+            
+            vm_statuses = self._fetch_vm_statuses(running_vms)
+            for (node_name, vm_id), vm_status in zip(running_vms, vm_statuses):
+                if not vm_status:
                     continue
                     
-                # Get all VMs on this node
-                node_vms = self.proxmox_api.get_node_vms(node['node']) or []
+                # Create entry in vm_performance_history if it doesn't exist
+                if vm_id not in self.vm_performance_history:
+                    self.vm_performance_history[vm_id] = _VMHistory()
                 
-                for vm in node_vms:
-                    if vm['status'] != 'running':
-                        continue
-                        
-                    vm_id = vm['vmid']
-                    vm_status = self.proxmox_api.get_vm_status(node['node'], vm_id)
-                    
-                    if not vm_status:
-                        continue
-                        
-                    # Create entry in vm_performance_history if it doesn't exist
-                    if vm_id not in self.vm_performance_history:
-                        self.vm_performance_history[vm_id] = []
-                    
-                    # Add current performance data
-                    self.vm_performance_history[vm_id].append({
-                        'timestamp': time.time(),
-                        'cpu': vm_status.get('cpu', 0),
-                        'memory_used': vm_status.get('mem', 0),
-                        'node': node['node']
-                    })
-                    
-                    # Limit history size to avoid memory issues
-                    max_history = 100
-                    if len(self.vm_performance_history[vm_id]) > max_history:
-                        self.vm_performance_history[vm_id] = self.vm_performance_history[vm_id][-max_history:]
+                # Add current performance data (oldest samples are overwritten automatically)
+                self.vm_performance_history[vm_id].append(
+                    vm_status.get('cpu', 0), vm_status.get('mem', 0), node_name)
             
             # If we have sufficient history, update VM affinity groups
             if self.config.get("auto_update_vm_groups", True) and len(self.vm_performance_history) >= 3:
@@ -1266,12 +2088,15 @@ class LoadBalancer:
                 last_update = self.config.get("last_vm_groups_update", 0)
                 if now - last_update > 86400:  # Update once a day
                     logger.info("Auto-updating VM affinity groups")
-                    self.update_vm_groups()
+                    self.update_vm_groups(snapshot)
                     self.config["last_vm_groups_update"] = now
-                    self.save_config()
+                    self._mark_config_dirty()
+            
+            # Write all configuration changes of this update at once
+            self.flush_config()
             
         except Exception as e:
-            logger.error(f"Error updating resource data: {str(e)}")
+            logger.error("Error updating resource data: %s", e)
     
     def detect_anomalies(self):
         """
@@ -1289,92 +2114,94 @@ class LoadBalancer:
             # Check for sudden resource spikes on nodes
             nodes_usage = self.proxmox_api.get_resource_usage()
             if nodes_usage:
-                for node in nodes_usage:
-                    node_name = node['name']
-                    
-                    # Skip offline nodes
-                    if node['status'] != 'online':
-                        continue
-                    
-                    # Get resource history for this node
-                    cpu_history = self.node_selector.resource_history[node_name]['cpu']
-                    memory_history = self.node_selector.resource_history[node_name]['memory']
-                    
-                    # Need enough history for anomaly detection
-                    if len(cpu_history) >= 5 and len(memory_history) >= 5:
-                        # Calculate mean and standard deviation for CPU and memory
-                        cpu_mean = sum(cpu_history[-5:]) / 5
-                        cpu_std = (sum((x - cpu_mean) ** 2 for x in cpu_history[-5:]) / 5) ** 0.5
-                        
-                        memory_mean = sum(memory_history[-5:]) / 5
-                        memory_std = (sum((x - memory_mean) ** 2 for x in memory_history[-5:]) / 5) ** 0.5
-                        
-                        # Current values
-                        current_cpu = node['cpu']['usage']
-                        current_memory = node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 0
-                        
-                        # Check if current values are significantly higher than recent history
-                        # (more than 3 standard deviations above mean)
-                        if cpu_std > 0 and (current_cpu - cpu_mean) / cpu_std > 3:
-                            anomalies.append({
-                                'type': 'node_cpu_spike',
-                                'node': node_name,
-                                'value': current_cpu,
-                                'mean': cpu_mean,
-                                'std': cpu_std,
-                                'z_score': (current_cpu - cpu_mean) / cpu_std
-                            })
-                        
-                        if memory_std > 0 and (current_memory - memory_mean) / memory_std > 3:
-                            anomalies.append({
-                                'type': 'node_memory_spike',
-                                'node': node_name,
-                                'value': current_memory,
-                                'mean': memory_mean,
-                                'std': memory_std,
-                                'z_score': (current_memory - memory_mean) / memory_std
-                            })
-            
-            # Check for VMs with unusual resource usage
-            for vm_id, history in self.vm_performance_history.items():
-                # Need enough history for anomaly detection
-                if len(history) >= 5:
-                    cpu_values = [entry.get('cpu', 0) for entry in history[-5:]]
-                    cpu_mean = sum(cpu_values) / 5
-                    cpu_std = (sum((x - cpu_mean) ** 2 for x in cpu_values) / 5) ** 0.5
+                # Skip offline nodes
+                online_nodes = [node for node in nodes_usage if node['status'] == 'online']
+                
+                # Last 5 samples of every node, need enough history for anomaly detection
+                windows, enough = self.node_selector.recent_usage([node['name'] for node in online_nodes], 5)
+                node_names = []
+                current_values = []
+                for node, has_history in zip(online_nodes, enough):
+                    if has_history:
+                        node_names.append(node['name'])
+                        current_values.append((
+                            node['cpu']['usage'],
+                            node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 0
+                        ))
+                
+                if node_names:
+                    # Mean and standard deviation of CPU and memory for all nodes at once
+                    windows = windows[enough, :2]  # (nodes, cpu/memory, 5)
+                    means = windows.mean(axis=2)
+                    stds = windows.std(axis=2)
+                    current = np.array(current_values)
                     
-                    current_cpu = history[-1].get('cpu', 0)
+                    # Current values more than 3 standard deviations above the recent mean
+                    z_scores = (current - means) / np.where(stds > 0, stds, 1)
+                    spikes = (stds > 0) & (z_scores > 3)
                     
-                    # Check for significant deviation
-                    if cpu_std > 0 and (current_cpu - cpu_mean) / cpu_std > 3:
-                        # Get VM details
-                        vm_node = history[-1].get('node')
-                        vm_status = self.proxmox_api.get_vm_status(vm_node, vm_id) if vm_node else None
-                        vm_name = vm_status.get('name', f'VM-{vm_id}') if vm_status else f'VM-{vm_id}'
-                        
+                    for i, j in zip(*np.nonzero(spikes)):
                         anomalies.append({
-                            'type': 'vm_cpu_spike',
-                            'vm_id': vm_id,
-                            'vm_name': vm_name,
-                            'node': vm_node,
-                            'value': current_cpu,
-                            'mean': cpu_mean,
-                            'std': cpu_std,
-                            'z_score': (current_cpu - cpu_mean) / cpu_std
+                            'type': ('node_cpu_spike', 'node_memory_spike')[j],
+                            'node': node_names[i],
+                            'value': float(current[i, j]),
+                            'mean': float(means[i, j]),
+                            'std': float(stds[i, j]),
+                            'z_score': float(z_scores[i, j])
                         })
+            
+            # Check for VMs with unusual resource usage, all VMs with enough history at once
+            vm_ids = [vm_id for vm_id, history in self.vm_performance_history.items() if len(history) >= ANOMALY_WINDOW]
+            if vm_ids:
+                # Window statistics are maintained incrementally by each history
+                stats = np.array([self.vm_performance_history[vm_id].cpu_window_stats() for vm_id in vm_ids])
+                means = stats[:, 0]
+                stds = stats[:, 1]
+                current = np.array([self.vm_performance_history[vm_id].recent('cpu', 1)[0] for vm_id in vm_ids],
+                                   dtype=np.float64)
+                z_scores = (current - means) / np.where(stds > 0, stds, 1)
+                
+                # Check for significant deviation
+                for i in np.flatnonzero((stds > 0) & (z_scores > 3)):
+                    vm_id = vm_ids[i]
+                    
+                    # Get VM details
+                    vm_node = self.vm_performance_history[vm_id].node
+                    vm_status = self.proxmox_api.get_vm_status(vm_node, vm_id) if vm_node else None
+                    vm_name = vm_status.get('name', f'VM-{vm_id}') if vm_status else f'VM-{vm_id}'
+                    
+                    anomalies.append({
+                        'type': 'vm_cpu_spike',
+                        'vm_id': vm_id,
+                        'vm_name': vm_name,
+                        'node': vm_node,
+                        'value': float(current[i]),
+                        'mean': float(means[i]),
+                        'std': float(stds[i]),
+                        'z_score': float(z_scores[i])
+                    })
         
         except Exception as e:
             logger.error(f"Error detecting anomalies: {str(e)}")
         
         return anomalies
         
-    def get_health_report(self):
+    def get_health_report(self, include_vms=True):
         """
         Generate a comprehensive health report for the cluster
         
+        Args:
+            include_vms (bool): Whether to fill in report['vms'], which needs
+                one status query per VM
+        
         Returns:
             dict: Health report
         """
+        return self._cached_report(('health', include_vms),
+                                   lambda: self._build_health_report(include_vms))
+    
+    def _build_health_report(self, include_vms):
+        """Build the report returned by get_health_report()"""
         report = {
             'timestamp': time.time(),
             'nodes': {},
@@ -1387,78 +2214,91 @@ class LoadBalancer:
             'anomalies': self.detect_anomalies()
         }
         
+        snapshot = self.create_snapshot()
+        
+        # Classify all nodes once, for constant-time checks in the node loop
+        overloaded_nodes, underloaded_nodes, _ = self._classify_nodes(snapshot)
+        overloaded_nodes = set(overloaded_nodes)
+        underloaded_nodes = set(underloaded_nodes)
+        
         # Get node status
-        nodes_usage = self.proxmox_api.get_resource_usage()
-        if nodes_usage:
-            for node in nodes_usage:
-                node_name = node['name']
-                
-                # Skip offline nodes
-                if node['status'] != 'online':
-                    report['nodes'][node_name] = {
-                        'status': 'offline',
-                        'uptime': 0
-                    }
-                    continue
-                
-                # Add node data
-                report['nodes'][node_name] = {
-                    'status': 'online',
-                    'cpu_usage': node['cpu']['usage'],
-                    'memory_usage': node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 0,
-                    'disk_usage': node['disk']['used'] / node['disk']['total'] if node['disk']['total'] > 0 else 0,
-                    'uptime': node['uptime'],
-                    'load': node.get('load', 0),
-                    'is_overloaded': node_name in self.detect_overloaded_nodes(),
-                    'is_underloaded': node_name in self.detect_underloaded_nodes()
+        nodes_usage = snapshot.nodes_usage or []
+        online_nodes = [node for node in nodes_usage if node['status'] == 'online']
+        
+        # Compute the usage ratios of all online nodes at once
+        node_memory = [node['memory'] for node in online_nodes]
+        node_disk = [node['disk'] for node in online_nodes]
+        memory_usage = _safe_ratios([memory['used'] for memory in node_memory],
+                                    [memory['total'] for memory in node_memory])
+        disk_usage = _safe_ratios([disk['used'] for disk in node_disk],
+                                  [disk['total'] for disk in node_disk])
+        node_ratios = {node['name']: ratios for node, ratios in zip(online_nodes, zip(memory_usage, disk_usage))}
+        
+        report_nodes = report['nodes']
+        for node in nodes_usage:
+            node_name = node['name']
+            
+            # Skip offline nodes
+            if node['status'] != 'online':
+                report_nodes[node_name] = {
+                    'status': 'offline',
+                    'uptime': 0
                 }
-        
-        # Get VM status for each node
-        for node_name in report['nodes']:
-            if report['nodes'][node_name]['status'] != 'online':
                 continue
-                
-            node_vms = self.proxmox_api.get_node_vms(node_name) or []
             
-            for vm in node_vms:
-                vm_id = vm['vmid']
-                
-                # Get VM status
-                vm_status = self.proxmox_api.get_vm_status(node_name, vm_id)
-                if not vm_status:
-                    continue
-                
-                # Add VM data
-                report['vms'][vm_id] = {
-                    'name': vm_status.get('name', f'VM-{vm_id}'),
-                    'status': vm_status.get('status', 'unknown'),
+            # Add node data
+            node_memory_usage, node_disk_usage = node_ratios[node_name]
+            report_nodes[node_name] = {
+                'status': 'online',
+                'cpu_usage': node['cpu']['usage'],
+                'memory_usage': node_memory_usage,
+                'disk_usage': node_disk_usage,
+                'uptime': node['uptime'],
+                'load': node.get('load', 0),
+                'is_overloaded': node_name in overloaded_nodes,
+                'is_underloaded': node_name in underloaded_nodes
+            }
+        
+        # Get VM status for each node, querying Proxmox in parallel
+        if include_vms:
+            online_vms = [(node_name, vm['vmid']) for node_name, vm in snapshot.iter_vms()
+                          if node_name in node_ratios]
+            vm_statuses = self._fetch_vm_statuses(online_vms)
+            found_vms = [(location, vm_status) for location, vm_status in zip(online_vms, vm_statuses) if vm_status]
+            vm_memory_usage = _safe_ratios([vm_status.get('mem', 0) for _, vm_status in found_vms],
+                                           [vm_status.get('maxmem', 0) for _, vm_status in found_vms])
+            
+            report_vms = report['vms']
+            vm_group_index = self._vm_group_index
+            for ((node_name, vm_id), vm_status), memory_ratio in zip(found_vms, vm_memory_usage):
+                # Add VM data, with the group it belongs to if any
+                get = vm_status.get
+                group_name = vm_group_index.get(vm_id)
+                report_vms[vm_id] = {
+                    'name': get('name', f'VM-{vm_id}'),
+                    'status': get('status', 'unknown'),
                     'node': node_name,
-                    'cpu_usage': vm_status.get('cpu', 0),
-                    'memory_usage': vm_status.get('mem', 0) / vm_status.get('maxmem', 1) if vm_status.get('maxmem', 0) > 0 else 0,
-                    'uptime': vm_status.get('uptime', 0),
-                    'in_group': False,
-                    'group_name': None
+                    'cpu_usage': get('cpu', 0),
+                    'memory_usage': memory_ratio,
+                    'uptime': get('uptime', 0),
+                    'in_group': group_name is not None,
+                    'group_name': group_name
                 }
-                
-                # Check if VM is in a group
-                for group_name, group_vms in self.config.get("vm_groups", {}).items():
-                    if str(vm_id) in group_vms or vm_id in group_vms:
-                        report['vms'][vm_id]['in_group'] = True
-                        report['vms'][vm_id]['group_name'] = group_name
-                        break
-        
-        # Migration statistics
-        recent_migrations = self.migration_history[-10:] if len(self.migration_history) > 10 else self.migration_history
-        successful_migrations = [m for m in self.migration_history if m.get('result') == 'success']
-        failed_migrations = [m for m in self.migration_history if m.get('result') == 'failed']
+        
+        # Migration statistics, counted in a single pass over the history
+        history = self.get_migration_history()
+        recent_migrations = _last_items(history, 10)
+        result_counts = Counter(m.get('result') for m in history)
+        successful_count = result_counts['success']
+        failed_count = result_counts['failed']
         
         # Add success rate
-        total_completed = len(successful_migrations) + len(failed_migrations)
-        report['migrations']['success_rate'] = len(successful_migrations) / total_completed if total_completed > 0 else 0
+        total_completed = successful_count + failed_count
+        report['migrations']['success_rate'] = successful_count / total_completed if total_completed > 0 else 0
         
         # Add recent migrations
         report['migrations']['recent'] = recent_migrations
-        report['migrations']['successful_count'] = len(successful_migrations)
-        report['migrations']['failed_count'] = len(failed_migrations)
+        report['migrations']['successful_count'] = successful_count
+        report['migrations']['failed_count'] = failed_count
         
         return report
\ No newline at end of file
@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import argparse
+import hmac
 import logging
 import threading
 import json
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from proxmox_api import ProxmoxAPI
-from load_balancer import LoadBalancer
+from load_balancer import LoadBalancer, configure_logging, _norm_vmid, _json_default
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+try:
+    from waitress import serve
+except ImportError:  # waitress is optional, fall back to Flask's threaded server
+    serve = None
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("load_balancer_api.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("ProxmoxLoadBalancerAPI")
 
 app = Flask(__name__)
@@ -25,38 +29,125 @@ load_balancer = None
 # API authentication (basic implementation)
 API_KEYS = {}
 
-def require_api_key(func):
-    """Decorator to require API key for routes"""
-    def wrapper(*args, **kwargs):
-        api_key = request.headers.get('X-API-Key')
-        if not api_key or api_key not in API_KEYS:
-            return jsonify({"error": "Invalid or missing API key"}), 401
-        return func(*args, **kwargs)
-    wrapper.__name__ = func.__name__
-    return wrapper
+# Long-running operations triggered through the API run in the background
+_task_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="api-task")
+_tasks = {}  # task ID -> (operation name, Future), oldest first
+_tasks_lock = threading.Lock()
+MAX_TASKS = 100  # Finished tasks kept for polling
+
+def _is_valid_api_key(api_key):
+    """Check an API key against the accepted keys in constant time"""
+    if not api_key:
+        return False
+    api_key = api_key.encode('utf-8')
+    return any(hmac.compare_digest(api_key, key.encode('utf-8')) for key in API_KEYS)
+
+# Endpoints served without an API key
+PUBLIC_ENDPOINTS = {'static'}
+
+@app.before_request
+def require_api_key():
+    """Reject requests without a valid API key, for every route but PUBLIC_ENDPOINTS"""
+    if request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    if not _is_valid_api_key(request.headers.get('X-API-Key')):
+        return jsonify({"error": "Invalid or missing API key"}), 401
+    return None
+
+def _dumps(obj):
+    """Serialize an object to compact JSON bytes, with orjson when available"""
+    if orjson:
+        # Accept int dict keys (VM IDs) like jsonify does, and NumPy scalars/arrays
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+def json_response(obj):
+    """Build a JSON response, faster than jsonify for large payloads"""
+    return Response(_dumps(obj), mimetype='application/json')
+
+def json_list_response(key, items):
+    """
+    Stream a JSON object holding a single list, serializing one item at a time
+    
+    Args:
+        key (str): Name of the list in the response object
+        items (iterable): Items of the list
+        
+    Returns:
+        Response: Streamed response of the form {"key": [item, ...]}
+    """
+    def generate():
+        yield b'{' + _dumps(key) + b':['
+        for index, item in enumerate(items):
+            yield _dumps(item) if index == 0 else b',' + _dumps(item)
+        yield b']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def submit_task(name, func):
+    """
+    Run an operation in the background, unless the same operation is already pending
+    
+    Args:
+        name (str): Operation name, at most one task per name runs at a time
+        func (callable): Function returning the JSON-serializable task result
+        
+    Returns:
+        Response: 202 response with the ID to poll at /api/tasks/<task_id>
+    """
+    with _tasks_lock:
+        for task_id, (task_name, future) in _tasks.items():
+            if task_name == name and not future.done():
+                break
+        else:
+            # Forget the oldest finished tasks
+            finished = [task_id for task_id, (_, future) in _tasks.items() if future.done()]
+            for task_id in finished[:max(0, len(_tasks) - MAX_TASKS + 1)]:
+                del _tasks[task_id]
+            
+            task_id = uuid.uuid4().hex
+            _tasks[task_id] = (name, _task_executor.submit(func))
+    
+    return jsonify({"status": "accepted", "task_id": task_id, "operation": name}), 202
+
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """Get the state of a background operation, and its result once done"""
+    with _tasks_lock:
+        task = _tasks.get(task_id)
+    if task is None:
+        return jsonify({"error": f"Unknown task {task_id}"}), 404
+    
+    name, future = task
+    if not future.done():
+        return jsonify({"task_id": task_id, "operation": name, "state": "running"})
+    
+    error = future.exception()
+    if error is not None:
+        return jsonify({"task_id": task_id, "operation": name, "state": "failed", "error": str(error)})
+    return json_response({"task_id": task_id, "operation": name, "state": "done", "result": future.result()})
 
 @app.route('/api/status', methods=['GET'])
-@require_api_key
 def get_status():
     """Get the current status of the load balancer"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
     status = load_balancer.get_status()
-    return jsonify(status)
+    return json_response(status)
 
 @app.route('/api/health', methods=['GET'])
-@require_api_key
 def get_health():
     """Get a comprehensive health report of the cluster"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
-    health_report = load_balancer.get_health_report()
-    return jsonify(health_report)
+    # Dashboards that only need node-level data can skip the per-VM status queries
+    include_vms = request.args.get('include_vms', 'true').lower() != 'false'
+    
+    health_report = load_balancer.get_health_report(include_vms=include_vms)
+    return json_response(health_report)
 
 @app.route('/api/recommendations', methods=['GET'])
-@require_api_key
 def get_recommendations():
     """Get migration recommendations"""
     if not load_balancer:
@@ -69,17 +160,20 @@ def get_recommendations():
     else:
         recommendations = load_balancer.get_recommendations()
         
-    return jsonify(recommendations)
+    return json_response(recommendations)
 
 @app.route('/api/nodes', methods=['GET'])
-@require_api_key
 def get_nodes():
     """Get information about all nodes"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
+    # Usage needs one status query per node, callers can opt out
+    include_usage = request.args.get('include_usage', 'true').lower() != 'false'
+    
     nodes = load_balancer.proxmox_api.get_nodes()
-    nodes_usage = load_balancer.proxmox_api.get_resource_usage()
+    nodes_usage = load_balancer.proxmox_api.get_resource_usage(nodes) if include_usage else None
+    usage_by_name = {usage['name']: usage for usage in (nodes_usage or [])}
     
     # Combine nodes data with resource usage
     result = []
@@ -91,58 +185,53 @@ def get_nodes():
         }
         
         # Add usage data if available
-        if nodes_usage:
-            for usage in nodes_usage:
-                if usage['name'] == node['node']:
-                    node_data['usage'] = {
-                        'cpu': usage['cpu'],
-                        'memory': usage['memory'],
-                        'disk': usage['disk'],
-                        'uptime': usage['uptime']
-                    }
-                    break
+        usage = usage_by_name.get(node['node'])
+        if usage:
+            node_data['usage'] = {
+                'cpu': usage['cpu'],
+                'memory': usage['memory'],
+                'disk': usage['disk'],
+                'uptime': usage['uptime']
+            }
         
         result.append(node_data)
         
-    return jsonify({'nodes': result})
+    return json_response({'nodes': result})
 
 @app.route('/api/vms', methods=['GET'])
-@require_api_key
 def get_vms():
     """Get information about all VMs"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
-    nodes = load_balancer.proxmox_api.get_nodes()
+    snapshot = load_balancer.create_snapshot()
     
     all_vms = []
-    for node in nodes:
-        if node['status'] != 'online':
-            continue
-            
-        node_vms = load_balancer.proxmox_api.get_node_vms(node['node']) or []
+    running_vms = []  # (index in all_vms, node name, VM ID) of running VMs
+    for node_name, vm in snapshot.iter_vms():
+        vm_data = {
+            'id': vm['vmid'],
+            'name': vm.get('name', f"VM-{vm['vmid']}"),
+            'status': vm['status'],
+            'node': node_name
+        }
         
-        for vm in node_vms:
-            vm_data = {
-                'id': vm['vmid'],
-                'name': vm.get('name', f"VM-{vm['vmid']}"),
-                'status': vm['status'],
-                'node': node['node']
-            }
-            
-            # Add VM status details if VM is running
-            if vm['status'] == 'running':
-                vm_status = load_balancer.proxmox_api.get_vm_status(node['node'], vm['vmid'])
-                if vm_status:
-                    vm_data['cpu_usage'] = vm_status.get('cpu', 0)
-                    vm_data['memory_usage'] = vm_status.get('mem', 0) / vm_status.get('maxmem', 1) if vm_status.get('maxmem', 0) > 0 else 0
-            
-            all_vms.append(vm_data)
+        if vm['status'] == 'running':
+            running_vms.append((len(all_vms), node_name, vm['vmid']))
+        
+        all_vms.append(vm_data)
+    
+    # Add VM status details of running VMs, fetched in parallel
+    vm_statuses = load_balancer._fetch_vm_statuses([(node_name, vm_id) for _, node_name, vm_id in running_vms])
+    for (index, _, _), vm_status in zip(running_vms, vm_statuses):
+        if vm_status:
+            vm_data = all_vms[index]
+            vm_data['cpu_usage'] = vm_status.get('cpu', 0)
+            vm_data['memory_usage'] = vm_status.get('mem', 0) / vm_status.get('maxmem', 1) if vm_status.get('maxmem', 0) > 0 else 0
     
-    return jsonify({'vms': all_vms})
+    return json_list_response('vms', all_vms)
 
 @app.route('/api/migrate', methods=['POST'])
-@require_api_key
 def migrate_vm():
     """Manually trigger VM migration"""
     if not load_balancer:
@@ -158,17 +247,28 @@ def migrate_vm():
     if not vm_id or not source_node or not target_node:
         return jsonify({"error": "Missing required parameters (vm_id, source_node, target_node)"}), 400
     
+    try:
+        vm_id = _norm_vmid(vm_id)
+    except (TypeError, ValueError):
+        return jsonify({"error": f"Invalid VM ID: {vm_id}"}), 400
+    
     # Optional parameters
     online = data.get('online', True)
     with_local_disks = data.get('with_local_disks', True)
     
+    # Fetch the target node status in the background while checking that the VM exists
+    snapshot = load_balancer.create_snapshot()
+    target_status = snapshot.executor.submit(snapshot.get_node_status, target_node)
+    
     # Get VM status to verify it exists
     vm_status = load_balancer.proxmox_api.get_vm_status(source_node, vm_id)
+    target_status.result()
     if not vm_status:
         return jsonify({"error": f"VM {vm_id} not found on node {source_node}"}), 404
     
-    # Check impact of migration
-    impact = load_balancer.analyze_migration_impact(vm_id, source_node, target_node)
+    # Check impact of migration, reusing the state fetched above
+    impact = load_balancer.analyze_migration_impact(vm_id, source_node, target_node,
+                                                    snapshot=snapshot, vm_status=vm_status)
     
     # Perform migration
     result = load_balancer.proxmox_api.migrate_vm(source_node, vm_id, target_node, online=online, with_local_disks=with_local_disks)
@@ -185,7 +285,7 @@ def migrate_vm():
             'vm_name': vm_status.get('name', f'VM-{vm_id}'),
             'result': 'initiated'
         }
-        load_balancer.migration_history.append(migration_record)
+        load_balancer.record_migration(migration_record)
         load_balancer.last_balance_time[vm_id] = time.time()
         
         return jsonify({
@@ -197,21 +297,19 @@ def migrate_vm():
         return jsonify({"status": "error", "message": f"Failed to migrate VM {vm_id}"}), 500
 
 @app.route('/api/balance', methods=['POST'])
-@require_api_key
 def balance_cluster():
     """Manually trigger a cluster balance"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
-    result = load_balancer.balance_cluster()
+    def run():
+        if load_balancer.balance_cluster():
+            return {"status": "success", "message": "Cluster balance initiated"}
+        return {"status": "info", "message": "No migrations were performed"}
     
-    if result:
-        return jsonify({"status": "success", "message": "Cluster balance initiated"})
-    else:
-        return jsonify({"status": "info", "message": "No migrations were performed"})
+    return submit_task("balance", run)
 
 @app.route('/api/config', methods=['GET'])
-@require_api_key
 def get_config():
     """Get the current configuration"""
     if not load_balancer:
@@ -220,7 +318,6 @@ def get_config():
     return jsonify(load_balancer.config)
 
 @app.route('/api/config', methods=['PUT'])
-@require_api_key
 def update_config():
     """Update the configuration"""
     if not load_balancer:
@@ -232,14 +329,20 @@ def update_config():
     if not isinstance(data, dict):
         return jsonify({"error": "Invalid configuration format"}), 400
     
-    # Update configuration (with validation)
+    # Reject the whole update if any value is invalid, before changing anything
+    rejected = [key for key, value in data.items()
+                if key in load_balancer.config and not load_balancer._is_valid_config_value(key, value)]
+    if rejected:
+        return jsonify({"error": "Invalid configuration values", "rejected_keys": rejected}), 400
+    
+    # Update configuration
     for key, value in data.items():
         if key in load_balancer.config:
             # Special handling for resource weights
             if key == "resource_weights" and isinstance(value, dict):
                 # Ensure weights sum to 1
                 total = sum(value.values())
-                if abs(total - 1.0) > 0.01:
+                if total > 0 and abs(total - 1.0) > 0.01:
                     # Normalize weights
                     value = {k: v/total for k, v in value.items()}
                 load_balancer.config[key] = value
@@ -248,13 +351,17 @@ def update_config():
             else:
                 load_balancer.config[key] = value
     
+    # Refresh VM exclusion and group lookups
+    load_balancer._index_vm_config()
+    if "migration_history_max" in data:
+        load_balancer.resize_migration_history()
+    
     # Save configuration
     load_balancer.save_config()
     
     return jsonify({"status": "success", "message": "Configuration updated", "config": load_balancer.config})
 
 @app.route('/api/vm_groups', methods=['GET'])
-@require_api_key
 def get_vm_groups():
     """Get VM affinity groups"""
     if not load_balancer:
@@ -263,43 +370,46 @@ def get_vm_groups():
     return jsonify({"vm_groups": load_balancer.config.get("vm_groups", {})})
 
 @app.route('/api/vm_groups/update', methods=['POST'])
-@require_api_key
 def update_vm_groups():
     """Update VM affinity groups automatically"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
-    success = load_balancer.update_vm_groups()
+    def run():
+        success = load_balancer.update_vm_groups()
+        load_balancer.flush_config()
+        
+        if success:
+            return {
+                "status": "success", 
+                "message": "VM groups updated", 
+                "vm_groups": load_balancer.config.get("vm_groups", {})
+            }
+        return {"status": "error", "message": "Failed to update VM groups"}
     
-    if success:
-        return jsonify({
-            "status": "success", 
-            "message": "VM groups updated", 
-            "vm_groups": load_balancer.config.get("vm_groups", {})
-        })
-    else:
-        return jsonify({"status": "error", "message": "Failed to update VM groups"}), 500
+    return submit_task("update_vm_groups", run)
 
 @app.route('/api/critical_vms/update', methods=['POST'])
-@require_api_key
 def update_critical_vms():
     """Update critical VMs automatically"""
     if not load_balancer:
         return jsonify({"error": "Load balancer not initialized"}), 500
         
-    success = load_balancer.update_critical_vms()
+    def run():
+        success = load_balancer.update_critical_vms()
+        load_balancer.flush_config()
+        
+        if success:
+            return {
+                "status": "success", 
+                "message": "Critical VMs updated", 
+                "critical_vms": load_balancer.config.get("proxmox_config", {}).get("critical_vms", [])
+            }
+        return {"status": "error", "message": "Failed to update critical VMs"}
     
-    if success:
-        return jsonify({
-            "status": "success", 
-            "message": "Critical VMs updated", 
-            "critical_vms": load_balancer.config.get("proxmox_config", {}).get("critical_vms", [])
-        })
-    else:
-        return jsonify({"status": "error", "message": "Failed to update critical VMs"}), 500
+    return submit_task("update_critical_vms", run)
 
 @app.route('/api/anomalies', methods=['GET'])
-@require_api_key
 def get_anomalies():
     """Get performance anomalies"""
     if not load_balancer:
@@ -307,10 +417,9 @@ def get_anomalies():
         
     anomalies = load_balancer.detect_anomalies()
     
-    return jsonify({"anomalies": anomalies})
+    return json_response({"anomalies": anomalies})
 
 @app.route('/api/migrations/history', methods=['GET'])
-@require_api_key
 def get_migration_history():
     """Get migration history"""
     if not load_balancer:
@@ -322,19 +431,30 @@ def get_migration_history():
     # Get optional filter by VM
     vm_id = request.args.get('vm_id', None, type=int)
     
-    history = load_balancer.migration_history
-    
-    # Apply filters
+    # Apply filter and limit
     if vm_id is not None:
-        history = [m for m in history if m['vm_id'] == vm_id]
-    
-    # Apply limit
-    if limit > 0:
-        history = history[-limit:]
+        history = load_balancer.get_vm_migration_history(vm_id, limit)
+    else:
+        history = load_balancer.get_migration_history(limit)
     
-    return jsonify({"migrations": history})
+    return json_list_response("migrations", history)
 
-def start_api(host, port, config_file, proxmox_api, api_key):
+def start_api(host, port, config_file, proxmox_api, api_key, threads=16):
+    """
+    Start the API server
+    
+    The load balancer state lives in this process, so requests are served by
+    a pool of threads rather than several worker processes. Handlers mostly
+    wait on Proxmox, so threads let slow requests overlap.
+    
+    Args:
+        host (str): Address to listen on
+        port (int): Port to listen on
+        config_file (str): Path to the load balancer configuration file
+        proxmox_api (ProxmoxAPI): Instance of the ProxmoxAPI class
+        api_key (str): API key accepted by the endpoints
+        threads (int): Number of request handling threads
+    """
     global load_balancer, API_KEYS
     
     # Set up API key
@@ -343,8 +463,12 @@ def start_api(host, port, config_file, proxmox_api, api_key):
     # Initialize load balancer
     load_balancer = LoadBalancer(proxmox_api, config_file=config_file)
     
-    # Start Flask app
-    app.run(host=host, port=port)
+    # Serve with waitress when installed, the Werkzeug server is meant for development
+    if serve:
+        serve(app, host=host, port=port, threads=threads)
+    else:
+        logger.warning("waitress is not installed, using the Flask development server")
+        app.run(host=host, port=port, threaded=True)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Proxmox Load Balancer API")
@@ -353,6 +477,7 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=5000, help="API port (default: 5000)")
     parser.add_argument("--config", default="load_balancer_config.json", help="Load balancer config file")
     parser.add_argument("--api-key", required=True, help="API key for authentication")
+    parser.add_argument("--threads", type=int, default=16, help="Request handling threads (default: 16)")
     
     # Connection options
     parser.add_argument("--proxmox-host", required=True, help="Proxmox host (IP or hostname)")
@@ -364,6 +489,9 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
+    # Set up logging
+    configure_logging("load_balancer_api.log")
+    
     # Initialize Proxmox API
     proxmox_api = ProxmoxAPI(
         host=args.proxmox_host,
@@ -382,4 +510,4 @@ if __name__ == "__main__":
     
     # Start API
     logger.info(f"Starting Proxmox Load Balancer API on {args.host}:{args.port}")
-    start_api(args.host, args.port, args.config, proxmox_api, args.api_key)
\ No newline at end of file
+    start_api(args.host, args.port, args.config, proxmox_api, args.api_key, args.threads)
\ No newline at end of file
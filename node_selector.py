@@ -1,25 +1,33 @@
 #!/usr/bin/env python3
+import threading
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from collections import defaultdict
+
+# Resources tracked in the usage history, in buffer order
+RESOURCES = ('cpu', 'memory', 'disk', 'network')
+MAX_NODE_HISTORY = 30  # Samples kept per node
 
 class NodeSelector:
     """Class to select the best node for deploying a VM or container"""
     
-    def __init__(self, proxmox_api):
+    def __init__(self, proxmox_api, max_history=MAX_NODE_HISTORY):
         """
         Initialize the NodeSelector
         
         Args:
             proxmox_api (ProxmoxAPI): Instance of the ProxmoxAPI class
+            max_history (int): Number of usage samples kept per node
         """
         self.proxmox_api = proxmox_api
-        self.resource_history = defaultdict(lambda: {
-            'cpu': [],
-            'memory': [],
-            'disk': [],
-            'network': []
-        })
+        self.max_history = max_history
+        # Usage history of all nodes in one ring buffer laid out as (node, resource, sample),
+        # so every node can be scored in a single vectorized pass
+        self._history = np.zeros((0, len(RESOURCES), max_history), dtype=np.float32)
+        self._head = np.zeros(0, dtype=np.intp)  # Position of the next sample of each node
+        self._count = np.zeros(0, dtype=np.intp)  # Number of samples stored for each node
+        self._node_index = {}  # node name -> row in the history buffers
+        self._history_lock = threading.Lock()  # Serializes history updates and row allocation
+        self._trend_weights = {}  # sample count -> weights giving the least-squares slope of a series
         # Default weights - can be adjusted based on importance
         self.weights = {
             'cpu': 0.35,
@@ -28,26 +36,115 @@ class NodeSelector:
             'network': 0.1
         }
     
-    def update_resource_history(self):
-        """Update resource usage history for all nodes"""
-        nodes_usage = self.proxmox_api.get_resource_usage()
+    def _node_row(self, node_name):
+        """
+        Get the history row of a node, allocating one for a node seen for the first time
+        
+        Must be called with _history_lock held. The buffers are grown before the
+        row is published in _node_index, so readers never see a row past their end.
+        """
+        row = self._node_index.get(node_name)
+        if row is None:
+            row = len(self._node_index)
+            if row == len(self._history):
+                # Grow the buffers, doubling their capacity
+                extra = max(8, row)
+                self._history = np.concatenate(
+                    [self._history, np.zeros((extra,) + self._history.shape[1:], dtype=self._history.dtype)])
+                self._head = np.concatenate([self._head, np.zeros(extra, dtype=np.intp)])
+                self._count = np.concatenate([self._count, np.zeros(extra, dtype=np.intp)])
+            self._node_index[node_name] = row
+        return row
+    
+    def _rows(self, node_names):
+        """
+        Get the history rows of several nodes
+        
+        Returns:
+            tuple: (rows, with -1 for unknown nodes; bool array of nodes with at least one sample)
+        """
+        rows = np.array([self._node_index.get(name, -1) for name in node_names], dtype=np.intp)
+        has_data = rows >= 0
+        has_data[has_data] = self._count[rows[has_data]] > 0
+        return rows, has_data
+    
+    def _recent(self, rows, count):
+        """
+        Get the last samples of several nodes
+        
+        Args:
+            rows (np.ndarray): History rows of nodes with at least `count` samples
+            count (int): Number of samples
+            
+        Returns:
+            np.ndarray: Samples shaped (node, resource, sample), oldest first
+        """
+        positions = (self._head[rows, None] - count + np.arange(count)) % self.max_history
+        return self._history[rows[:, None], :, positions].transpose(0, 2, 1)
+    
+    def update_resource_history(self, nodes_usage=None):
+        """
+        Update resource usage history for all nodes
+        
+        Args:
+            nodes_usage (list, optional): Usage already returned by get_resource_usage()
+        """
+        if nodes_usage is None:
+            nodes_usage = self.proxmox_api.get_resource_usage()
         if not nodes_usage:
             return
+        
+        online_nodes = [node for node in nodes_usage if node['status'] == 'online']
+        if not online_nodes:
+            return
+        
+        # Memory and disk usage ratios, counted as full when the total is unknown
+        memory = np.array([(node['memory']['used'], node['memory']['total']) for node in online_nodes], dtype=np.float64)
+        disk = np.array([(node['disk']['used'], node['disk']['total']) for node in online_nodes], dtype=np.float64)
+        samples = np.zeros((len(online_nodes), len(RESOURCES)))
+        samples[:, 0] = [node['cpu']['usage'] for node in online_nodes]
+        np.divide(memory[:, 0], memory[:, 1], out=samples[:, 1], where=memory[:, 1] > 0)
+        samples[memory[:, 1] <= 0, 1] = 1
+        np.divide(disk[:, 0], disk[:, 1], out=samples[:, 2], where=disk[:, 1] > 0)
+        samples[disk[:, 1] <= 0, 2] = 1
+        
+        # Write the samples of all nodes at once, the oldest ones are overwritten when full
+        with self._history_lock:
+            rows = np.array([self._node_row(node['name']) for node in online_nodes], dtype=np.intp)
+            self._history[rows, :, self._head[rows]] = samples
+            self._head[rows] = (self._head[rows] + 1) % self.max_history
+            self._count[rows] = np.minimum(self._count[rows] + 1, self.max_history)
+    
+    @property
+    def resource_history(self):
+        """Usage history per node name and resource, oldest sample first (read-only copy)"""
+        history = {}
+        for node_name, row in self._node_index.items():
+            count = int(self._count[row])
+            samples = self._recent(np.array([row]), count)[0] if count else np.zeros((len(RESOURCES), 0))
+            history[node_name] = {resource: samples[i].tolist() for i, resource in enumerate(RESOURCES)}
+        return history
+    
+    def recent_usage(self, node_names, count):
+        """
+        Get the last usage samples of several nodes
+        
+        Args:
+            node_names (list): Names of the nodes
+            count (int): Number of samples
             
-        for node in nodes_usage:
-            node_name = node['name']
-            if node['status'] == 'online':
-                self.resource_history[node_name]['cpu'].append(node['cpu']['usage'])
-                mem_used_percent = node['memory']['used'] / node['memory']['total'] if node['memory']['total'] > 0 else 1
-                self.resource_history[node_name]['memory'].append(mem_used_percent)
-                disk_used_percent = node['disk']['used'] / node['disk']['total'] if node['disk']['total'] > 0 else 1
-                self.resource_history[node_name]['disk'].append(disk_used_percent)
-                
-                # Keep history limited to avoid memory issues
-                max_history = 30
-                for resource_type in ['cpu', 'memory', 'disk', 'network']:
-                    if len(self.resource_history[node_name][resource_type]) > max_history:
-                        self.resource_history[node_name][resource_type] = self.resource_history[node_name][resource_type][-max_history:]
+        Returns:
+            tuple: (array shaped (node, resource, sample) with the samples oldest first,
+                zeros for nodes with fewer samples; bool array of nodes with at least `count` samples)
+        """
+        rows = np.array([self._node_index.get(name, -1) for name in node_names], dtype=np.intp)
+        enough = rows >= 0
+        enough[enough] = self._count[rows[enough]] >= count
+        
+        samples = np.zeros((len(node_names), len(RESOURCES), count))
+        if enough.any():
+            samples[enough] = self._recent(rows[enough], count)
+        return samples, enough
     
     def set_weights(self, weights):
         """
@@ -64,6 +161,59 @@ class NodeSelector:
             
         self.weights = weights
     
+    def _slope_weights(self, count):
+        """
+        Get the weights w such that y @ w is the least-squares slope of a series y against 0..count-1
+        
+        They only depend on the number of samples, so they are computed once per count.
+        
+        Args:
+            count (int): Number of samples in the series
+            
+        Returns:
+            np.ndarray: Centered sample positions divided by their sum of squares
+        """
+        weights = self._trend_weights.get(count)
+        if weights is None:
+            x_centered = np.arange(count) - (count - 1) / 2
+            weights = x_centered / (x_centered ** 2).sum()
+            self._trend_weights[count] = weights
+        return weights
+    
+    def _predict(self, rows, hours_ahead=1):
+        """
+        Predict the usage of all resources of several nodes with a linear trend
+        
+        Args:
+            rows (np.ndarray): History rows of the nodes
+            hours_ahead (int): Number of hours to predict ahead
+            
+        Returns:
+            np.ndarray: Predicted usage shaped (node, resource), capped to [0, 1]
+        """
+        predicted = np.zeros((len(rows), len(RESOURCES)))
+        counts = self._count[rows]
+        
+        # Nodes with the same number of samples share the regression inputs
+        for count in np.unique(counts):
+            if count == 0:
+                continue
+            selected = counts == count
+            y = self._recent(rows[selected], count).astype(np.float64)
+            
+            # If not enough data, use the last value
+            if count < 3:
+                predicted[selected] = y[:, :, -1]
+                continue
+            
+            # Least-squares slope of every (node, resource) series with one matmul
+            slope = y @ self._slope_weights(count)
+            
+            # Value of the trend line at x = count + hours_ahead
+            predicted[selected] = np.clip(y.mean(axis=2) + slope * (count + hours_ahead - (count - 1) / 2), 0, 1)
+        
+        return predicted
+    
     def predict_future_load(self, node_name, resource_type, hours_ahead=1):
         """
         Predict future load for a specific resource on a node
@@ -76,35 +226,54 @@ class NodeSelector:
         Returns:
             float: Predicted resource usage
         """
-        history = self.resource_history[node_name][resource_type]
-        if not history:
+        row = self._node_index.get(node_name)
+        if row is None or not self._count[row]:
             return 0
-            
-        # Simple linear trend prediction
-        if len(history) < 3:
-            return history[-1]  # If not enough data, return last value
-            
-        # Use last few points for prediction
-        x = np.array(range(len(history))).reshape(-1, 1)
-        y = np.array(history)
-        
-        # Simple linear regression
-        n = len(x)
-        x_mean = np.mean(x)
-        y_mean = np.mean(y)
-        
-        # Calculate slope and intercept
-        slope = np.sum((x - x_mean) * (y - y_mean)) / np.sum((x - x_mean) ** 2)
-        intercept = y_mean - slope * x_mean
+        return float(self._predict(np.array([row]), hours_ahead)[0, RESOURCES.index(resource_type)])
+    
+    def _blended_load(self, rows):
+        """
+        Combine current and predicted usage, giving more weight to current
         
-        # Predict future value
-        future_x = n + hours_ahead
-        predicted_value = slope * future_x + intercept
+        Args:
+            rows (np.ndarray): History rows of nodes with at least one sample
+            
+        Returns:
+            np.ndarray: Load shaped (node, resource)
+        """
+        current = self._history[rows, :, (self._head[rows] - 1) % self.max_history]
+        return current * 0.7 + self._predict(rows) * 0.3
+    
+    def _can_host(self, node_names, rows, allowed, vm_requirements, nodes=None, nodes_usage=None):
+        """
+        Clear the allowed flag of the nodes without room for a VM
         
-        # Cap at reasonable values
-        predicted_value = max(0, min(1, predicted_value))
+        Args:
+            node_names (list): Names of the candidate nodes
+            rows (np.ndarray): History rows of the candidates
+            allowed (np.ndarray): Bool flags updated in place
+            vm_requirements (dict): VM requirements for cpu, memory, disk
+            nodes (list, optional): Node list already returned by get_nodes()
+            nodes_usage (list, optional): Usage already returned by get_resource_usage()
+        """
+        if nodes is None:
+            nodes = self.proxmox_api.get_nodes() or []
+        if nodes_usage is None:
+            nodes_usage = self.proxmox_api.get_resource_usage(nodes) or []
+        max_cpus = {n['node']: n.get('maxcpu', 0) for n in nodes}
+        usage_by_name = {u['name']: u for u in nodes_usage}
+        current_cpu = self._history[rows, 0, (self._head[rows] - 1) % self.max_history]
         
-        return predicted_value
+        for i, name in enumerate(node_names):
+            if not allowed[i] or name not in max_cpus or name not in usage_by_name:
+                continue
+            max_cpu = max_cpus[name]
+            available_cpu = max_cpu - max_cpu * float(current_cpu[i])
+            usage = usage_by_name[name]
+            if (vm_requirements.get('cpu', 0) > available_cpu or
+                    vm_requirements.get('memory', 0) > usage['memory']['free'] or
+                    vm_requirements.get('disk', 0) > usage['disk']['free']):
+                allowed[i] = False
     
     def calculate_node_score(self, node_name, vm_requirements=None):
         """
@@ -117,65 +286,104 @@ class NodeSelector:
         Returns:
             float: Node score (lower is better)
         """
-        if not self.resource_history[node_name]['cpu']:
+        return float(self.calculate_node_scores([node_name], vm_requirements)[0])
+    
+    def calculate_node_scores(self, node_names, vm_requirements=None, nodes=None, nodes_usage=None):
+        """
+        Calculate the score of several nodes at once, as calculate_node_score does for one
+        
+        Args:
+            node_names (list): Names of the nodes
+            vm_requirements (dict, optional): VM requirements for cpu, memory, disk
+            nodes (list, optional): Node list already returned by get_nodes()
+            nodes_usage (list, optional): Usage already returned by get_resource_usage()
+            
+        Returns:
+            np.ndarray: Score per node (lower is better), inf for nodes without
+                data or without room for the VM
+        """
+        scores = np.full(len(node_names), np.inf)
+        if not node_names:
+            return scores
+        
+        rows, allowed = self._rows(node_names)
+        if not allowed.all():
             self.update_resource_history()
-            # If still no data, return infinity (worst score)
-            if not self.resource_history[node_name]['cpu']:
-                return float('inf')
-        
-        # Current usage
-        current_cpu = self.resource_history[node_name]['cpu'][-1]
-        current_memory = self.resource_history[node_name]['memory'][-1]
-        current_disk = self.resource_history[node_name]['disk'][-1]
-        
-        # Predicted usage in 1 hour
-        predicted_cpu = self.predict_future_load(node_name, 'cpu')
-        predicted_memory = self.predict_future_load(node_name, 'memory')
-        predicted_disk = self.predict_future_load(node_name, 'disk')
-        
-        # Combine current and predicted (giving more weight to current)
-        cpu_score = current_cpu * 0.7 + predicted_cpu * 0.3
-        memory_score = current_memory * 0.7 + predicted_memory * 0.3
-        disk_score = current_disk * 0.7 + predicted_disk * 0.3
-        
-        # Check if node meets VM requirements
-        if vm_requirements:
-            # Get node details
-            nodes = self.proxmox_api.get_nodes()
-            node_info = next((n for n in nodes if n['node'] == node_name), None)
-            
-            if node_info:
-                node_status = self.proxmox_api.get_node_status(node_name)
-                
-                # Calculate available resources
-                available_cpu = node_info.get('maxcpu', 0) - (node_info.get('maxcpu', 0) * current_cpu)
-                available_memory = node_status.get('memory', {}).get('free', 0)
-                available_disk = node_status.get('rootfs', {}).get('free', 0)
-                
-                # Check if requirements are met
-                if vm_requirements.get('cpu', 0) > available_cpu:
-                    return float('inf')  # Not enough CPU
-                if vm_requirements.get('memory', 0) > available_memory:
-                    return float('inf')  # Not enough memory
-                if vm_requirements.get('disk', 0) > available_disk:
-                    return float('inf')  # Not enough disk space
-        
-        # Calculate weighted score
-        final_score = (
-            cpu_score * self.weights['cpu'] +
-            memory_score * self.weights['memory'] +
-            disk_score * self.weights['disk']
-        )
+            rows, allowed = self._rows(node_names)
+        
+        # Check which nodes can host the VM
+        if vm_requirements and allowed.any():
+            self._can_host(node_names, rows, allowed, vm_requirements, nodes, nodes_usage)
+        
+        if not allowed.any():
+            return scores
+        rows = rows[allowed]
+        
+        # Weighted score of the blended cpu, memory and disk load of all nodes at once
+        weights = np.array([self.weights.get(resource, 0) for resource in ('cpu', 'memory', 'disk')])
+        final_scores = np.einsum('nr,r->n', self._blended_load(rows)[:, :3], weights)
         
         # Add variability factor based on standard deviation of resource usage
         # This helps avoid nodes with highly variable loads
-        if len(self.resource_history[node_name]['cpu']) > 5:
-            cpu_std = np.std(self.resource_history[node_name]['cpu'][-5:])
-            memory_std = np.std(self.resource_history[node_name]['memory'][-5:])
-            variability_factor = (cpu_std + memory_std) / 2
-            final_score += variability_factor * 0.1  # Add 10% weight to variability
+        variable = self._count[rows] > 5
+        if variable.any():
+            recent = self._recent(rows[variable], 5)[:, :2].astype(np.float64)  # cpu and memory
+            variability_factor = recent.std(axis=2).mean(axis=1)
+            final_scores[variable] += variability_factor * 0.1  # Add 10% weight to variability
         
-        return final_score
+        scores[allowed] = final_scores
+        return scores
+    
+    def score_all(self, node_names, vm_requirements=None, nodes=None, nodes_usage=None):
+        """
+        Score several candidate nodes at once with TOPSIS
+        
+        Each node is described by its cpu, memory and disk load (current usage
+        blended with the predicted one, as in calculate_node_score). The
+        closeness of a node is its relative distance to the ideal (least loaded)
+        and negative-ideal (most loaded) candidates, weighted by self.weights.
+        
+        Args:
+            node_names (list): Names of the candidate nodes
+            vm_requirements (dict, optional): VM requirements for cpu, memory, disk
+            nodes (list, optional): Node list already returned by get_nodes()
+            nodes_usage (list, optional): Usage already returned by get_resource_usage()
+            
+        Returns:
+            np.ndarray: Closeness per candidate in [0, 1] (higher is better),
+                -1 for nodes without data or without room for the VM
+        """
+        closeness = np.full(len(node_names), -1.0)
+        if not node_names:
+            return closeness
+        
+        rows, allowed = self._rows(node_names)
+        if not allowed.all():
+            self.update_resource_history()
+            rows, allowed = self._rows(node_names)
+        
+        # Check which nodes can host the VM
+        if vm_requirements and allowed.any():
+            self._can_host(node_names, rows, allowed, vm_requirements, nodes, nodes_usage)
+        
+        if not allowed.any():
+            return closeness
+        
+        # Decision matrix (candidates x criteria), all criteria are costs
+        resources = ('cpu', 'memory', 'disk')
+        matrix = self._blended_load(rows[allowed])[:, :len(resources)]
+        
+        norms = np.linalg.norm(matrix, axis=0)
+        norms[norms == 0] = 1
+        weighted = matrix / norms * np.array([self.weights.get(r, 0) for r in resources])
+        
+        d_pos = np.linalg.norm(weighted - weighted.min(axis=0), axis=1)
+        d_neg = np.linalg.norm(weighted - weighted.max(axis=0), axis=1)
+        total = d_pos + d_neg
+        # Identical candidates are all as good as the ideal one
+        closeness[allowed] = np.divide(d_neg, total, out=np.ones_like(total), where=total > 0)
+        
+        return closeness
     
     def select_best_node(self, vm_requirements=None, excluded_nodes=None):
         """
@@ -188,33 +396,26 @@ class NodeSelector:
         Returns:
             str: Name of the best node, or None if no suitable node found
         """
-        # Update resource history
-        self.update_resource_history()
-        
-        # Get all nodes
+        # Get all nodes and their usage once for the history update and the scores
         nodes = self.proxmox_api.get_nodes()
         if not nodes:
             return None
-            
-        excluded_nodes = excluded_nodes or []
-        node_scores = {}
+        nodes_usage = self.proxmox_api.get_resource_usage(nodes) or []
         
-        for node in nodes:
-            node_name = node['node']
-            
-            # Skip excluded nodes and offline nodes
-            if node_name in excluded_nodes or node['status'] != 'online':
-                continue
-                
-            # Calculate score for this node
-            score = self.calculate_node_score(node_name, vm_requirements)
-            node_scores[node_name] = score
+        # Update resource history
+        self.update_resource_history(nodes_usage)
         
-        if not node_scores:
+        excluded_nodes = excluded_nodes or []
+        
+        # Skip excluded nodes and offline nodes
+        candidates = [node['node'] for node in nodes
+                      if node['node'] not in excluded_nodes and node['status'] == 'online']
+        if not candidates:
             return None
-            
+        
         # Return the node with the lowest score
-        return min(node_scores.items(), key=lambda x: x[1])[0]
+        scores = self.calculate_node_scores(candidates, vm_requirements, nodes=nodes, nodes_usage=nodes_usage)
+        return candidates[int(np.argmin(scores))]
     
     def get_node_recommendations(self, count=3, vm_requirements=None):
         """
@@ -227,29 +428,50 @@ class NodeSelector:
         Returns:
             list: List of node names in order of preference
         """
-        # Update resource history
-        self.update_resource_history()
+        return self.get_node_recommendations_for([vm_requirements], count)[0]
+    
+    def get_node_recommendations_for(self, requirements_list, count=3):
+        """
+        Get node recommendations for several VMs at once
+        
+        The requirements of a VM only decide which nodes can host it, not
+        how the nodes compare, so the nodes are scored and sorted once and
+        that ranking is filtered for each VM.
         
-        # Get all nodes
+        Args:
+            requirements_list (list): VM requirements (dict or None) per VM
+            count (int): Number of recommendations to return per VM
+            
+        Returns:
+            list: List of node names in order of preference, per VM
+        """
+        # Get all nodes and their usage once for the history update and the scores
         nodes = self.proxmox_api.get_nodes()
         if not nodes:
-            return []
-            
-        node_scores = {}
+            return [[] for _ in requirements_list]
+        nodes_usage = self.proxmox_api.get_resource_usage(nodes) or []
         
-        for node in nodes:
-            node_name = node['node']
-            
-            # Skip offline nodes
-            if node['status'] != 'online':
-                continue
-                
-            # Calculate score for this node
-            score = self.calculate_node_score(node_name, vm_requirements)
-            node_scores[node_name] = score
+        # Update resource history
+        self.update_resource_history(nodes_usage)
+        
+        # Skip offline nodes
+        candidates = [node['node'] for node in nodes if node['status'] == 'online']
+        if not candidates:
+            return [[] for _ in requirements_list]
         
         # Sort nodes by score (lower is better)
-        sorted_nodes = sorted(node_scores.items(), key=lambda x: x[1])
+        order = np.argsort(self.calculate_node_scores(candidates, nodes=nodes), kind='stable')
+        rows, has_data = self._rows(candidates)
+        
+        recommendations = []
+        for vm_requirements in requirements_list:
+            if not vm_requirements:
+                recommendations.append([candidates[i] for i in order[:count]])
+                continue
+            allowed = has_data.copy()
+            self._can_host(candidates, rows, allowed, vm_requirements, nodes, nodes_usage)
+            # Nodes that can host the VM keep their rank, the others follow in node order
+            picks = np.concatenate((order[allowed[order]], np.flatnonzero(~allowed)))
+            recommendations.append([candidates[i] for i in picks[:count]])
         
-        # Return the top N nodes
-        return [node for node, _ in sorted_nodes[:count]]
\ No newline at end of file
+        return recommendations
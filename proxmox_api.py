@@ -1,16 +1,63 @@
 #!/usr/bin/env python3
 import requests
 import json
+import copy
 import time
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import InsecureRequestWarning
 
 # Suppress only the specific InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+# Maximum number of responses kept by the cache of a ProxmoxAPI instance
+CACHE_MAXSIZE = 512
+
+def _ttl_cached(method):
+    """
+    Cache the result of a read-only API method for ``cache_ttl`` seconds
+    
+    Results are keyed on the method name and arguments, so repeated queries
+    issued within a short window reuse the same response. Failed requests
+    (None) are not cached. Callers get their own copy of the response, so
+    they may modify it. At most CACHE_MAXSIZE responses are kept: expired
+    ones are dropped first, then the oldest ones.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.cache_ttl <= 0:
+            return method(self, *args, **kwargs)
+        
+        key = (method.__name__,) + args
+        if kwargs:
+            key += tuple(sorted(kwargs.items()))
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            return copy.deepcopy(entry[1])
+        
+        result = method(self, *args, **kwargs)
+        if result is not None:
+            with self._cache_lock:
+                cache = self._cache
+                cache.pop(key, None)
+                if len(cache) >= CACHE_MAXSIZE:
+                    for expired in [k for k, (expiry, _) in cache.items() if expiry <= now]:
+                        del cache[expired]
+                    # Entries are kept in insertion order, the first ones are the oldest
+                    while len(cache) >= CACHE_MAXSIZE:
+                        del cache[next(iter(cache))]
+                cache[key] = (now + self.cache_ttl, copy.deepcopy(result))
+        return result
+    return wrapper
+
 class ProxmoxAPI:
     """Class to interact with the Proxmox API"""
     
-    def __init__(self, host, user, password, realm='pam', verify_ssl=False, port=8006):
+    def __init__(self, host, user, password, realm='pam', verify_ssl=False, port=8006, cache_ttl=5):
         """
         Initialize the Proxmox API connection
         
@@ -21,6 +68,7 @@ class ProxmoxAPI:
             realm (str): Authentication realm (pam, pve, etc.)
             verify_ssl (bool): Whether to verify SSL certificate
             port (int): API port
+            cache_ttl (float): Seconds to reuse responses of read-only queries (0 disables caching)
         """
         self.host = host
         self.user = user
@@ -32,6 +80,17 @@ class ProxmoxAPI:
         self.token = None
         self.csrf_token = None
         self.token_expires = 0
+        self.cache_ttl = cache_ttl
+        self._cache = {}  # (method name, *args) -> (expiry time, response)
+        self._cache_lock = threading.Lock()
+        
+        # Keep connections alive across requests, sized for parallel fetches
+        self._session = requests.Session()
+        self._session.verify = verify_ssl
+        self._session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=32))
+        # Fans out per-node queries, lazily created on first use
+        self._executor = None
+        self._executor_lock = threading.Lock()
         
     def login(self):
         """Authenticate with Proxmox API and get tokens"""
@@ -42,12 +101,16 @@ class ProxmoxAPI:
         }
         
         try:
-            response = requests.post(auth_url, data=auth_data, verify=self.verify_ssl)
+            response = self._session.post(auth_url, data=auth_data)
             response.raise_for_status()
             
             result = response.json()['data']
             self.token = result['ticket']
             self.csrf_token = result['CSRFPreventionToken']
+            self._session.headers.update({
+                "Cookie": f"PVEAuthCookie={self.token}",
+                "CSRFPreventionToken": self.csrf_token
+            })
             # Set token expiration to 2 hours from now
             self.token_expires = time.time() + 7200
             
@@ -97,10 +160,9 @@ class ProxmoxAPI:
             params = query_params
             
         url = f"{self.api_url}/{endpoint}"
-        headers = {"Cookie": f"PVEAuthCookie={self.token}"}
         
         try:
-            response = requests.get(url, headers=headers, params=params, verify=self.verify_ssl)
+            response = self._session.get(url, params=params)
             response.raise_for_status()
             return response.json()['data']
         except Exception as e:
@@ -122,27 +184,49 @@ class ProxmoxAPI:
             return None
             
         url = f"{self.api_url}/{endpoint}"
-        headers = {
-            "Cookie": f"PVEAuthCookie={self.token}",
-            "CSRFPreventionToken": self.csrf_token
-        }
         
         try:
-            response = requests.post(url, data=data, headers=headers, verify=self.verify_ssl)
+            response = self._session.post(url, data=data)
             response.raise_for_status()
             return response.json()['data']
         except Exception as e:
             print(f"POST request failed: {str(e)}")
             return None
+    
+    def _map(self, func, items):
+        """
+        Call a function on several items concurrently, keeping the order of the results
+        
+        Args:
+            func (callable): Function issuing an API request
+            items (list): Arguments, one call per item
+            
+        Returns:
+            list: Results in the order of items
+        """
+        if len(items) < 2:
+            return [func(item) for item in items]
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="proxmox-api")
+        return list(self._executor.map(func, items))
+    
+    def invalidate(self):
+        """Drop all cached responses, e.g. after the cluster state was changed"""
+        with self._cache_lock:
+            self._cache.clear()
             
+    @_ttl_cached
     def get_nodes(self):
         """Get list of all nodes in the cluster"""
         return self.get("nodes")
     
+    @_ttl_cached
     def get_node_status(self, node):
         """Get status information for a specific node"""
         return self.get(f"nodes/{node}/status")
         
+    @_ttl_cached
     def get_node_vms(self, node):
         """Get all VMs on a specific node"""
         return self.get(f"nodes/{node}/qemu")
@@ -155,6 +239,7 @@ class ProxmoxAPI:
         """Get VM configuration"""
         return self.get(f"nodes/{node}/qemu/{vmid}/config")
     
+    @_ttl_cached
     def get_vm_status(self, node, vmid):
         """Get VM status"""
         return self.get(f"nodes/{node}/qemu/{vmid}/status/current")
@@ -179,7 +264,11 @@ class ProxmoxAPI:
             "with-local-disks": 1 if with_local_disks else 0
         }
         
-        return self.post(f"nodes/{node}/qemu/{vmid}/migrate", data=data)
+        result = self.post(f"nodes/{node}/qemu/{vmid}/migrate", data=data)
+        if result is not None:
+            # VM placement and node load are about to change
+            self.invalidate()
+        return result
     
     def get_cluster_resources(self, resource_type=None):
         """
@@ -197,16 +286,28 @@ class ProxmoxAPI:
         
         return self.get(endpoint)
     
-    def get_resource_usage(self):
-        """Get detailed resource usage information across the cluster"""
-        nodes_data = self.get_nodes()
+    def get_resource_usage(self, nodes_data=None):
+        """
+        Get detailed resource usage information across the cluster
+
+        Args:
+            nodes_data (list, optional): Node list already returned by get_nodes(),
+                to avoid fetching it again
+
+        Returns:
+            list: Resource usage per node
+        """
+        if nodes_data is None:
+            nodes_data = self.get_nodes()
         if not nodes_data:
             return None
             
+        # Query the status of all nodes concurrently
+        statuses = self._map(self.get_node_status, [node['node'] for node in nodes_data])
+        
         result = []
-        for node in nodes_data:
+        for node, status in zip(nodes_data, statuses):
             node_name = node['node']
-            status = self.get_node_status(node_name)
             
             if status:
                 result.append({
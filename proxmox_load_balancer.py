@@ -15,7 +15,7 @@ import logging
 import time
 from proxmox_api import ProxmoxAPI
 from node_selector import NodeSelector
-from load_balancer import LoadBalancer
+from load_balancer import LoadBalancer, configure_logging
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -292,8 +292,7 @@ def show_cluster_status(load_balancer):
         print(f"  {node['name']}: {len(running_vms)} running, {len(vms) - len(running_vms)} stopped")
     
     # Show overloaded and underloaded nodes
-    overloaded = load_balancer.detect_overloaded_nodes()
-    underloaded = load_balancer.detect_underloaded_nodes()
+    overloaded, underloaded, _ = load_balancer._classify_nodes()
     
     if overloaded:
         print(f"\nOverloaded Nodes: {', '.join(overloaded)}")
@@ -303,7 +302,7 @@ def show_cluster_status(load_balancer):
     # Show recent migrations
     if load_balancer.migration_history:
         print("\nRecent Migrations:")
-        for migration in load_balancer.migration_history[-5:]:
+        for migration in load_balancer.get_migration_history(5):
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(migration['timestamp']))
             print(f"  VM {migration['vm_id']} from {migration['source_node']} to {migration['target_node']} at {timestamp}")
     
@@ -391,14 +390,7 @@ def main():
     args = parse_arguments()
     
     # Set up logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler("load_balancer.log"),
-            logging.StreamHandler()
-        ]
-    )
+    configure_logging("load_balancer.log")
     logger = logging.getLogger("ProxmoxLoadBalancer")
     
     # Get password if not provided
@@ -430,6 +422,7 @@ def main():
         args.auto_configure_proxmox is not None or args.configure_ha is not None or 
         args.configure_migration is not None or args.ha_group_name or args.critical_vm):
         load_balancer.config = update_config_from_args(load_balancer.config, args)
+        load_balancer._index_vm_config()
     
     # Handle different operation modes
     if args.config:
@@ -437,6 +430,7 @@ def main():
         new_config = config_interactive(load_balancer)
         if new_config:
             load_balancer.config = new_config
+            load_balancer._index_vm_config()
             if args.save_config:
                 load_balancer.save_config(args.config_file)
                 print(f"Configuration saved to {args.config_file}")
@@ -473,6 +467,7 @@ def main():
         # Update critical VMs list
         print("Identifying critical VMs for HA...")
         result = load_balancer.update_critical_vms()
+        load_balancer.flush_config()
         
         if result:
             print("Critical VMs have been updated in configuration.")